@@ -0,0 +1,229 @@
+# This file builds the pre-aggregated sightings cube (counts by year, month and grid cell) the charts read from
+
+# Import packages
+import threading
+
+import numpy as np
+import pandas as pd
+
+from data_cache import parse_version
+from instrumentation import span
+
+# Size of a grid cell in degrees (roughly 11km north-south over the UK)
+GRID_RES = 0.1
+
+# Cell index used for sightings without a valid location
+NO_CELL = np.iinfo(np.int16).min
+
+CUBE_COLUMNS = ['year', 'month', 'lat_cell', 'lon_cell', 'species', 'count']
+
+# Latest cube per query, so a refresh only has to recount the months that changed
+_cubes = {}
+_combined_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+# Grid cell indices for lat/lon arrays
+def grid_cells(lat, lon, res=GRID_RES):
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    located = np.isfinite(lat) & np.isfinite(lon)
+    lat_cell = np.where(located, np.floor(np.where(located, lat, 0) / res), NO_CELL).astype('int16')
+    lon_cell = np.where(located, np.floor(np.where(located, lon, 0) / res), NO_CELL).astype('int16')
+    return lat_cell, lon_cell
+
+
+# Count cleaned sightings by (year, month, lat cell, lon cell, species) in one vectorised pass
+def build_cube(clean, res=GRID_RES):
+    species = clean['species'].cat.categories
+    if clean.empty:
+        cube = pd.DataFrame({col: pd.Series(dtype='int16' if col != 'count' else 'int32') for col in CUBE_COLUMNS})
+        cube['species'] = pd.Categorical([], categories=species)
+        return cube
+
+    # Species are counted by their codes, so only the species that are there get rows
+    lat_cell, lon_cell = grid_cells(clean['lat'], clean['lon'], res)
+    keys = pd.DataFrame({
+        'year': clean['year'].to_numpy(),
+        'month': clean['month'].to_numpy(),
+        'lat_cell': lat_cell,
+        'lon_cell': lon_cell,
+        'species': clean['species'].cat.codes.to_numpy(),
+    })
+    cube = keys.value_counts(sort=False).rename('count').reset_index()
+    cube['count'] = cube['count'].astype('int32')
+    cube['species'] = pd.Categorical.from_codes(cube['species'].to_numpy(), categories=species)
+    return cube.sort_values(['year', 'month'], kind='stable').reset_index(drop=True)[CUBE_COLUMNS]
+
+
+# Recount from the month of `since` onwards and keep the earlier part of the cube as it was.
+# Incremental refreshes only add records on or after the newest cached date, so older months can't change.
+def refresh_cube(cube, clean, since, res=GRID_RES):
+    start = pd.Timestamp(year=since.year, month=since.month, day=1)
+    first_row = clean['date'].searchsorted(start)
+    before = (cube['year'].astype('int32') * 12 + cube['month']) < start.year * 12 + start.month
+    return pd.concat([cube[before], build_cube(clean.iloc[first_row:], res)], ignore_index=True)
+
+
+# Cube for a dataset version, shared by every session.
+# A new version from an incremental refresh of the same full fetch only recounts the newest months.
+def get_cube(version, clean):
+    key, full_fetched_at, _ = parse_version(version)
+    with _cubes_lock:
+        cached = _cubes.get(key)
+        if cached is not None and cached['version'] == version:
+            return cached['cube']
+
+        if cached is not None and cached['full_fetched_at'] == full_fetched_at and cached['last_date'] is not None:
+            with span("cube.refresh", rows=len(clean)):
+                cube = refresh_cube(cached['cube'], clean, cached['last_date'])
+        else:
+            with span("cube.build", rows=len(clean)):
+                cube = build_cube(clean)
+
+        _cubes[key] = {
+            'version': version,
+            'full_fetched_at': full_fetched_at,
+            'cube': cube,
+            'last_date': clean['date'].iloc[-1] if not clean.empty else None,
+        }
+        return cube
+
+
+# Add cubes together (e.g. one per species)
+def combine_cubes(cubes):
+    if len(cubes) == 1:
+        return cubes[0]
+    keys = ['year', 'month', 'lat_cell', 'lon_cell', 'species']
+    cube = pd.concat(cubes, ignore_index=True).groupby(keys, sort=False, observed=True)['count'].sum().reset_index()
+    cube['count'] = cube['count'].astype('int32')
+    return cube.sort_values(['year', 'month'], kind='stable').reset_index(drop=True)[CUBE_COLUMNS]
+
+
+# Combined cube for a set of dataset versions, shared by every session that picks the same set
+def get_combined_cube(versions, cubes):
+    if len(cubes) == 1:
+        return cubes[0]
+    key = tuple(versions)
+    with _cubes_lock:
+        if key not in _combined_cubes:
+            # Only keep the most recent few combinations
+            while len(_combined_cubes) >= 8:
+                _combined_cubes.pop(next(iter(_combined_cubes)))
+            _combined_cubes[key] = combine_cubes(cubes)
+        return _combined_cubes[key]
+
+
+# Sightings per year, or with by_species a column of sightings per year for each species in the cube
+def yearly_counts(cube, by_species=False):
+    if by_species:
+        return cube.groupby(['year', 'species'], observed=True)['count'].sum().unstack(fill_value=0)
+    return cube.groupby('year')['count'].sum()
+
+
+# Seasons in calendar order, and the season code for each month (index 0 is unused)
+SEASONS = ['Spring', 'Summer', 'Autumn', 'Winter']
+SEASON_OF_MONTH = np.array([-1, 3, 3, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3], dtype='int8')
+
+
+# Month and season counts for each species, from arrays of months and species (a categorical) in one bincount pass.
+# Returns long frames with a row per (species, month) and per (species, season), for the species that are there.
+def species_month_season_counts(months, species):
+    categories = species.cat.categories
+    codes = species.cat.codes.to_numpy().astype('int64')
+    counts = np.bincount(codes * 13 + np.asarray(months, dtype='int64'), minlength=len(categories) * 13)
+    counts = counts.reshape(len(categories), 13)[:, 1:]
+    present = np.flatnonzero(counts.sum(axis=1))
+    names = pd.CategoricalIndex(categories[present], categories=categories, name='species')
+
+    monthly = pd.DataFrame(counts[present], index=names, columns=pd.RangeIndex(1, 13, name='month'))
+    # Each month's counts go to its season
+    seasons = counts[present] @ (SEASON_OF_MONTH[1:, None] == np.arange(len(SEASONS)))
+    seasonal = pd.DataFrame(seasons, index=names,
+                            columns=pd.CategoricalIndex(SEASONS, categories=SEASONS, ordered=True, name='season'))
+    return monthly.stack().rename('sightings').reset_index(), seasonal.stack().rename('sightings').reset_index()
+
+
+# Map binning modes
+BIN_MODES = ['hex', 'grid', 'points']
+
+# Latitude the maps are centred on, used to keep cells roughly square on the ground
+UK_LAT = 54.0
+
+# Most points sent to the browser for one map
+MAX_POINTS_PER_MAP = 2000
+
+
+# Cell size in degrees of latitude for a map zoom level (about 8 screen pixels per cell)
+def resolution_for_zoom(zoom, pixels=8):
+    return 360 / (256 * 2 ** zoom) * pixels
+
+
+# Count rows per unique (a, b) pair using hashing rather than sorting
+def _count_pairs(a, b):
+    a_codes, a_values = pd.factorize(a)
+    b_codes, b_values = pd.factorize(b)
+    counts = pd.Series(a_codes.astype('int64') * len(b_values) + b_codes).value_counts(sort=False)
+    keys = counts.index.to_numpy()
+    return a_values[keys // len(b_values)], b_values[keys % len(b_values)], counts.to_numpy()
+
+
+# Bin lat/lon points into square grid cells or hexagons of `res` degrees and return one weighted point per cell.
+# 'points' keeps every distinct location as it is.
+def bin_points(lat, lon, mode='hex', res=0.1, ref_lat=UK_LAT):
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    if lat.size == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'count': []})
+
+    # Work in units where a degree of longitude is as long as a degree of latitude
+    scale = np.cos(np.radians(ref_lat))
+    x = lon * scale
+    y = lat
+
+    if mode == 'points':
+        centre_y, centre_x, counts = _count_pairs(y, x)
+    elif mode == 'grid':
+        row, col, counts = _count_pairs(np.floor(y / res).astype('int64'), np.floor(x / res).astype('int64'))
+        centre_y = (row + 0.5) * res
+        centre_x = (col + 0.5) * res
+    elif mode == 'hex':
+        # Pointy-top hexagons of width `res`: convert to axial coordinates and round to the nearest hexagon
+        size = res / np.sqrt(3)
+        q = (np.sqrt(3) / 3 * x - y / 3) / size
+        r = (2 / 3 * y) / size
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        hq, hr, counts = _count_pairs(rq.astype('int64'), rr.astype('int64'))
+        centre_x = size * np.sqrt(3) * (hq + hr / 2)
+        centre_y = size * 1.5 * hr
+    else:
+        raise ValueError(f"Unknown binning mode: {mode}")
+
+    return pd.DataFrame({
+        'lat': centre_y.astype('float32'),
+        'lon': (centre_x / scale).astype('float32'),
+        'count': counts.astype('int32'),
+    })
+
+
+# Bin points for a map at a zoom level, coarsening the cells until the result fits in `max_points`.
+# Returns the binned points and the cell size used (None when every distinct location fitted).
+def binned_points(lat, lon, mode='hex', zoom=5, max_points=MAX_POINTS_PER_MAP):
+    res = resolution_for_zoom(zoom)
+    if mode == 'points':
+        points = bin_points(lat, lon, 'points')
+        if len(points) <= max_points:
+            return points, None
+        mode = 'grid'
+
+    points = bin_points(lat, lon, mode, res)
+    while len(points) > max_points:
+        res *= 2
+        points = bin_points(lat, lon, mode, res)
+    return points, res
@@ -3,44 +3,113 @@
 # Import packages
 import streamlit as st
 import pandas as pd
-import requests
-import numpy as np
+import time
+from data_cache import fetched_at, refresh_status
+from cleaning import get_clean_occurrences, get_combined_occurrences, get_located_occurrences
+from aggregates import get_combined_cube, get_cube
+from queries import DEFAULT_SPECIES, SPECIES, load_snapshots, species_label, taxon_params
+from export import EXPORT_PORT, start_export_server
+from instrumentation import METRICS_PORT, debug_enabled, render_debug_panel, span, start_metrics_server, start_rerun
+
+# The cleaned data is shared between sessions, so never modify it in place
+pd.set_option("mode.copy_on_write", True)
+
+# Start timing this rerun, and serve the running totals for Prometheus if a port is configured
+start_rerun()
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
+
+# Serve streamed data downloads if a port is configured (see export.py)
+if EXPORT_PORT:
+    start_export_server(EXPORT_PORT)
+
+# Wide layout for every page - this has to come before anything is drawn, so pages don't set it themselves
+st.set_page_config(layout="wide")
 
 # Set up pages, create titles
 pg = st.navigation([st.Page("home.py", title="Welcome"),
         st.Page("over_time.py", title="Sightings Over Time (Time Series)"),
         st.Page("map_visual.py", title="Sightings Over Time (Map Visual)"),
         st.Page("seasonal_changes.py", title="Seasonal Changes"),
-        st.Page("recommendations.py", title="Insights & Recommendations")
+        st.Page("recommendations.py", title="Insights & Recommendations"),
+        st.Page("download_data.py", title="Download Data")
         ])
 
+# Species to show - the otter by default, several can be shown together
+selected_species = st.sidebar.multiselect("Species", list(SPECIES), default=[DEFAULT_SPECIES]) or [DEFAULT_SPECIES]
+species_params = [taxon_params(SPECIES[name]) for name in selected_species]
+
 
 # Function to load data from API
+# Results are cached on disk and shared across sessions, and refreshed by a background thread.
+# Sessions are served the latest snapshot straight away, only a cold start with no cache waits for the API.
+# Several species are fetched concurrently.
 def load_data():
-    url = "https://records-ws.nbnatlas.org/occurrences/search"
-    params = {
-        "q": "otter",  # Search term for otter sightings
-        "pageSize": 200000  # Limit number of results to speed up App performance
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        if data.get("occurrences"):
-            df = pd.json_normalize(data['occurrences'], errors='ignore')
-            df_sorted = df.sort_values(by='eventDate', ascending=True)
-            df = df_sorted.dropna(subset=['eventDate'])
-            return df
-    return None
-
-# Load data into session state
-if 'otter_data' not in st.session_state:
-    st.session_state.otter_data = load_data()
+    return load_snapshots(species_params)
+
+
+# Describe how long ago something happened, e.g. "5 minutes"
+def describe_age(seconds):
+    for unit, size in [("day", 86400), ("hour", 3600), ("minute", 60)]:
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+    return "less than a minute"
+
+# Load the latest snapshots into session state - a newer snapshot from the background refresh
+# is picked up on the next interaction
+with span("load_data"):
+    snapshots = [(name, df, version) for name, (df, version) in zip(selected_species, load_data()) if df is not None]
+versions = tuple(version for _, _, version in snapshots)
+version = "+".join(versions) if snapshots else None
+if 'otter_version' not in st.session_state or (version is not None and version != st.session_state.otter_version):
+    st.session_state.otter_data = [df for _, df, _ in snapshots] or None
+    st.session_state.otter_species = [name for name, _, _ in snapshots]
+    st.session_state.otter_versions = versions
+    st.session_state.otter_version = version
+
+# Species names for page titles
+st.session_state.species_label = species_label(st.session_state.otter_species or selected_species)
 
 # Check if data is loaded successfully
 if st.session_state.otter_data is not None:
-    df = st.session_state.otter_data
+    raw_frames = st.session_state.otter_data
+    versions = st.session_state.otter_versions
+
+    # Cleaned data for the pages, built once per dataset version and merged across the chosen species.
+    # Every row keeps its species, so the charts and downloads can tell them apart.
+    clean_frames = [get_clean_occurrences(v, name, df)
+                    for v, name, df in zip(versions, st.session_state.otter_species, raw_frames)]
+    st.session_state.otter_clean = get_combined_occurrences(versions, tuple(clean_frames))
+    st.session_state.otter_located = get_located_occurrences(st.session_state.otter_version, st.session_state.otter_clean)
+
+    # Counts by year, month and grid cell that the charts read from
+    cubes = [get_cube(v, clean) for v, clean in zip(versions, clean_frames)]
+    st.session_state.otter_cube = get_combined_cube(versions, cubes)
+
+    # Show how old the data is, and whether the latest refresh failed
+    last_fetched = min(t for t in (fetched_at(params) for params in species_params) if t is not None)
+    st.sidebar.caption(f"*Data updated {describe_age(time.time() - last_fetched)} ago.*")
+    statuses = [refresh_status(params) for params in species_params]
+    if any(status is not None and status["error"] is not None for status in statuses):
+        st.sidebar.caption("*The latest refresh from the NBN Atlas failed, showing the last good data.*")
+    if len(snapshots) < len(species_params):
+        st.sidebar.caption("*Some species couldn't be loaded and are left out.*")
 else:
+    st.session_state.otter_clean = None
+    st.session_state.otter_located = None
+    st.session_state.otter_cube = None
     st.error("Failed to load data.")
     
 # This line runs all of the pages outlined above
-pg.run()
+with span(f"page: {pg.title}"):
+    pg.run()
+
+# Per-stage timings and data frame memory for this rerun, when asked for
+if debug_enabled():
+    render_debug_panel({
+        **{f"raw ({name})": df for name, df in zip(st.session_state.otter_species, st.session_state.otter_data or [])},
+        "clean": st.session_state.otter_clean,
+        "located": st.session_state.otter_located,
+        "cube": st.session_state.otter_cube,
+    })
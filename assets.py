@@ -0,0 +1,60 @@
+# This file prepares static assets (the welcome page image) once and keeps them on disk
+
+# Import packages
+import os
+import threading
+import time
+from io import BytesIO
+
+import requests
+from PIL import Image
+
+from data_cache import CACHE_DIR
+
+HERO_IMAGE_URL = "https://images.squarespace-cdn.com/content/v1/654a3265fcbd755384b0552f/a9312805-4ca9-4994-9879-c6f9e1c5338f/Otter+on+Skye+by+Sophie+Hall+2.JPG?format=2500w"
+HERO_IMAGE_HEIGHT = 900
+HERO_IMAGE_TIMEOUT_SECONDS = 10
+
+# After a failed download, wait this long before trying again
+RETRY_AFTER_SECONDS = 5 * 60
+
+# Prepared images held in memory for this process, and when each last failed to download
+_images = {}
+_failed_at = {}
+_images_lock = threading.Lock()
+
+
+# Download an image and save a copy resized to `height` pixels tall as a JPEG, returns the saved path
+def resize_image(url, path, height, timeout=HERO_IMAGE_TIMEOUT_SECONDS):
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    image = Image.open(BytesIO(response.content))
+    width = int(image.width * (height / image.height))
+    resized = image.convert("RGB").resize((width, height), Image.LANCZOS)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    resized.save(tmp_path, format="JPEG", quality=85)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Resized welcome image as JPEG bytes, downloaded and resized only the first time it's needed and then
+# served from memory (or from disk after a restart).
+# Returns None if it isn't on disk and can't be fetched, so the page can fall back to the original URL.
+def get_hero_image(url=HERO_IMAGE_URL, height=HERO_IMAGE_HEIGHT, cache_dir=CACHE_DIR):
+    path = os.path.join(cache_dir, f"hero_{height}.jpg")
+    with _images_lock:
+        if path in _images:
+            return _images[path]
+        if not os.path.exists(path):
+            if time.time() - _failed_at.get(path, 0) < RETRY_AFTER_SECONDS:
+                return None
+            try:
+                resize_image(url, path, height)
+            except (requests.RequestException, OSError):
+                _failed_at[path] = time.time()
+                return None
+        with open(path, "rb") as f:
+            _images[path] = f.read()
+        return _images[path]
@@ -0,0 +1,207 @@
+# This file load tests the whole multipage app headlessly, with many sessions running at the same time
+#
+# Usage (from the repository root):
+#   python -m benchmarks.load_test                            # 10 sessions, 200k records
+#   python -m benchmarks.load_test --sessions 50 --rounds 3 --records 2M
+#   python -m benchmarks.load_test --json results.json        # also write the results to a file
+#
+# Each session is a Streamlit AppTest of app.py that loads the app, then clicks through every page
+# `--rounds` times. AppTest swaps out Streamlit's global runtime while it runs, so two can't run at once in
+# one process - each session gets its own process instead, like a worker behind a load balancer. They all
+# share one cache directory (disk cache, memory-mapped frames, locality names) as workers on a host would.
+# The NBN API is the local stub from stub_nbn.py and reverse geocoding is a stub with a fixed delay, so
+# nothing leaves the machine. Sessions start together on a cold cache unless --warm is given.
+# Reported: rerun latency per page (p50/p95), peak RSS and how many upstream requests were made.
+
+# Import packages
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.stub_nbn import start_stub_api
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+
+# Pages in the order a session visits them, the first is what the app opens on
+PAGES = ["home.py", "over_time.py", "map_visual.py", "seasonal_changes.py", "recommendations.py", "download_data.py"]
+
+
+# Stand-in for the Nominatim reverse geocoder, counts its calls
+class StubGeocoder:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    # Called like geopy's reverse, returns something shaped like a geopy location
+    def __call__(self, point, exactly_one=True, language='en'):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        lat, lon = point
+
+        class Location:
+            raw = {"address": {"town": f"Town {lat:.1f},{lon:.1f}"}}
+        return Location()
+
+
+# Small placeholder for the welcome image, so the home page doesn't download the real one
+def write_hero_image(cache_dir):
+    from PIL import Image
+
+    from assets import HERO_IMAGE_HEIGHT
+
+    os.makedirs(cache_dir, exist_ok=True)
+    Image.new("RGB", (HERO_IMAGE_HEIGHT * 3 // 2, HERO_IMAGE_HEIGHT), (90, 120, 140)).save(
+        os.path.join(cache_dir, f"hero_{HERO_IMAGE_HEIGHT}.jpg"), format="JPEG")
+
+
+# One simulated user, in its own process: open the app, then visit every page `rounds` times.
+# Puts its rerun latencies (page, seconds), any exceptions the app raised, its geocoder calls and
+# its peak RSS on `results`.
+def run_session(nbn_url, rounds, timeout, geocode_delay, start_barrier, results):
+    import geocode_cache
+    import nbn_api
+    from streamlit.testing.v1 import AppTest
+
+    nbn_api.NBN_SEARCH_URL = nbn_url
+    geocoder = StubGeocoder(geocode_delay)
+    geocode_cache.nominatim_reverse = lambda: geocoder
+
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    latencies, errors = [], []
+    start_barrier.wait()
+    try:
+        for round_number in range(rounds):
+            for page in PAGES:
+                start = time.perf_counter()
+                if round_number == 0 and page == PAGES[0]:
+                    at.run()
+                else:
+                    at.switch_page(page).run()
+                latencies.append((page, time.perf_counter() - start))
+                errors.extend(f"{page}: {exception.message}" for exception in at.exception)
+    except Exception as e:
+        errors.append(f"{type(e).__name__}: {e}")
+    results.put({"latencies": latencies, "errors": errors, "geocoder_requests": geocoder.calls,
+                 "peak_rss_mb": peak_rss_mb()})
+
+
+# Peak resident memory of this process in MB (ru_maxrss is in kilobytes on Linux and bytes on macOS)
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def run_load_test(sessions, rounds, records, geocode_delay=0.05, timeout=300, seed=0, warm=False):
+    # The app reads its cache directory when it's imported, so point it at a fresh one first.
+    # Session processes inherit it.
+    os.environ["OTTER_CACHE_DIR"] = tempfile.mkdtemp(prefix="otter-load-test-")
+    os.chdir(REPO_DIR)
+
+    from benchmarks.run import parse_size
+    from data_cache import CACHE_DIR
+
+    records = parse_size(str(records))
+    server, url = start_stub_api(records, seed=seed)
+    write_hero_image(CACHE_DIR)
+    if warm:
+        warm_cache(url)
+    warm_requests = server.request_count
+
+    context = multiprocessing.get_context("spawn")
+    start_barrier = context.Barrier(sessions)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_session, args=(url, rounds, timeout, geocode_delay, start_barrier, results),
+                        name=f"session-{i}")
+        for i in range(sessions)
+    ]
+    start = time.perf_counter()
+    try:
+        for process in processes:
+            process.start()
+        session_results = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        server.shutdown()
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in session_results for latency in result["latencies"]]
+    errors = [error for result in session_results for error in result["errors"]]
+
+    def summary(seconds):
+        seconds = np.asarray(seconds if seconds else [np.nan])
+        return {"reruns": int(np.isfinite(seconds).sum()), "p50_ms": float(np.percentile(seconds, 50) * 1000),
+                "p95_ms": float(np.percentile(seconds, 95) * 1000), "max_ms": float(seconds.max() * 1000)}
+
+    return {
+        "sessions": sessions,
+        "rounds": rounds,
+        "records": records,
+        "warm": warm,
+        "wall_seconds": elapsed,
+        "pages": {page: summary([s for p, s in latencies if p == page]) for page in PAGES},
+        "all": summary([s for _, s in latencies]),
+        "peak_rss_mb": max(result["peak_rss_mb"] for result in session_results),
+        "total_rss_mb": sum(result["peak_rss_mb"] for result in session_results),
+        "nbn_requests": server.request_count - warm_requests,
+        "geocoder_requests": sum(result["geocoder_requests"] for result in session_results),
+        "errors": sorted(set(errors)),
+    }
+
+
+# Fill the disk cache before the sessions start, as a long-running deployment would have it
+def warm_cache(nbn_url):
+    import nbn_api
+    from data_cache import get_occurrences
+    from queries import taxon_params
+
+    nbn_api.NBN_SEARCH_URL = nbn_url
+    get_occurrences(taxon_params("Lutra lutra"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the dashboard with concurrent headless sessions.")
+    parser.add_argument("--sessions", type=int, default=10, help="sessions running at the same time")
+    parser.add_argument("--rounds", type=int, default=2, help="times each session visits every page")
+    parser.add_argument("--records", default="200k", help="records served by the stub API, e.g. 10k, 200k, 2M")
+    parser.add_argument("--geocode-delay", type=float, default=0.05, help="seconds per stub geocoder lookup")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds a single rerun may take")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm", action="store_true", help="fill the disk cache before the sessions start")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = run_load_test(args.sessions, args.rounds, args.records, args.geocode_delay, args.timeout,
+                            args.seed, args.warm)
+
+    print(f"{results['sessions']} sessions x {results['rounds']} rounds, {results['records']:,} records, "
+          f"{'warm' if results['warm'] else 'cold'} cache, {results['wall_seconds']:.1f}s")
+    print(f"{'page':<24}{'reruns':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for page, stats in list(results["pages"].items()) + [("all", results["all"])]:
+        print(f"{page:<24}{stats['reruns']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    print(f"Peak RSS: {results['peak_rss_mb']:.0f} MB per session process, {results['total_rss_mb']:.0f} MB in total")
+    print(f"Upstream requests: NBN API {results['nbn_requests']}, geocoder {results['geocoder_requests']}")
+    for error in results["errors"]:
+        print(f"Error: {error}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
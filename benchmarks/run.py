@@ -0,0 +1,171 @@
+# This file times each page's data path headlessly (outside Streamlit) against synthetic NBN data
+#
+# Usage (from the repository root):
+#   python -m benchmarks.run                          # 10k and 200k records, compared with the baseline
+#   python -m benchmarks.run --sizes 10k,200k,2M
+#   python -m benchmarks.run --save                   # record the results as the new baseline
+#   python -m benchmarks.run --check                  # exit with an error if any stage regressed
+#
+# Ingestion goes through the real paginated fetcher against a local stub API (see stub_nbn.py),
+# so no network access is needed. The stub's pages are generated before the clock starts, so the
+# stage times fetching and parsing only. Every other stage is timed best-of-N on the ingested data.
+
+# Import packages
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import pandas as pd
+
+from aggregates import binned_points, build_cube, species_month_season_counts, yearly_counts
+from benchmarks.stub_nbn import page_bodies, start_stub_api
+from cleaning import clean_occurrences, last_years, located_occurrences, time_window, year_partitions, year_range
+from hotspots import find_hotspots
+from nbn_api import DASHBOARD_FL, PAGE_SIZE, fetch_occurrences
+from trends import area_trends
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# A stage counts as regressed when it's this much slower than the baseline, and by at least this many
+# seconds - stages that take a millisecond or two swing by more than the ratio from run to run
+REGRESSION_RATIO = 1.25
+MIN_REGRESSION_SECONDS = 0.005
+
+# Fixed "today" so the time windows cover the same records on every run
+TODAY = pd.Timestamp("2025-12-31")
+
+MAP_YEARS = [2009, 2014, 2019, 2024]
+
+
+# "10k" -> 10000, "2M" -> 2000000
+def parse_size(text):
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * multiplier)
+
+
+# Best-of-N wall time of fn() in seconds, and its last result
+def best_of(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# Time every stage for one dataset size, returns {stage: seconds}
+def run_size(size, repeat=3, seed=0):
+    results = {}
+
+    # Ingestion: paginated, concurrent, projected fetch from the stub API, as the app does it.
+    # The pages are serialised beforehand, so generating the records isn't timed.
+    params = {"q": "otter", "fl": DASHBOARD_FL}
+    server, url = start_stub_api(size, seed=seed, bodies=page_bodies(size, PAGE_SIZE, seed, params["fl"]))
+    try:
+        results["ingest"], raw = best_of(lambda: fetch_occurrences(params, url=url, max_records=size), 1)
+    finally:
+        server.shutdown()
+    raw = raw.dropna(subset=["eventDate"]).sort_values("eventDate", kind="stable").reset_index(drop=True)
+
+    results["clean"], clean = best_of(lambda: clean_occurrences(raw), repeat)
+    located = located_occurrences(clean)
+
+    # over_time: yearly totals for each species, via the cube
+    results["cube_build"], cube = best_of(lambda: build_cube(clean), repeat)
+    results["over_time_yearly"], _ = best_of(lambda: yearly_counts(cube, by_species=True), repeat)
+    results["over_time_area_trends"], _ = best_of(lambda: area_trends(cube, "Otter"), repeat)
+
+    # seasonal_changes: month and season counts for each species over the last 10 years
+    start, _ = last_years(10, TODAY)
+
+    def seasonal():
+        recent = time_window(clean, start)
+        return species_month_season_counts(recent["month"], recent["species"])
+    results["seasonal"], _ = best_of(seasonal, repeat)
+
+    # map_visual: one binned map per year, read from the year partitions
+    def map_years():
+        partitions = year_partitions(located)
+        for year in MAP_YEARS:
+            year_rows = year_range(located, partitions, year, year)
+            binned_points(year_rows["lat"], year_rows["lon"], "hex", 5)
+    results["map_visual_years"], _ = best_of(map_years, repeat)
+
+    # recommendations: top 5 hotspots over the last 10 years
+    def hotspot_ranking():
+        recent = time_window(located, start)
+        return find_hotspots(recent["lat"], recent["lon"], top_n=5)
+    results["recommendations_hotspots"], _ = best_of(hotspot_ranking, repeat)
+
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump({
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor() or platform.machine()},
+            "recorded_at": time.strftime("%Y-%m-%d"),
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard's data path on synthetic NBN data.")
+    parser.add_argument("--sizes", default="10k,200k", help="comma separated record counts, e.g. 10k,200k,2M")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--check", action="store_true", help="exit with an error if a stage regressed")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    results = {}
+    regressions = []
+
+    print(f"{'size':<8}{'stage':<28}{'seconds':>10}{'baseline':>10}{'ratio':>8}")
+    for label in [size.strip() for size in args.sizes.split(",")]:
+        results[label] = run_size(parse_size(label), args.repeat, args.seed)
+        for stage, seconds in results[label].items():
+            before = baseline.get(label, {}).get(stage)
+            ratio = seconds / before if before else None
+            flag = ""
+            if ratio is not None and ratio > REGRESSION_RATIO and seconds - before >= MIN_REGRESSION_SECONDS:
+                flag = "  slower"
+                regressions.append(f"{label} {stage}")
+            print(f"{label:<8}{stage:<28}{seconds:>10.4f}"
+                  f"{before if before is not None else float('nan'):>10.4f}"
+                  f"{ratio if ratio is not None else float('nan'):>8.2f}{flag}")
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    print(f"Peak RSS: {peak_mb:.0f} MB")
+
+    if args.save:
+        save_baseline(dict(load_baseline(args.baseline), **results), args.baseline)
+        print(f"Saved baseline to {args.baseline}")
+
+    if args.check and regressions:
+        print(f"Regressed more than {REGRESSION_RATIO:.2f}x and {MIN_REGRESSION_SECONDS * 1000:.0f}ms: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# This file generates synthetic NBN Atlas occurrence records and serves them from a local stub of the search API
+#
+# Records are shaped like the real /occurrences/search response (same field names and types, a mix of
+# precise and grid-reference locations clustered along rivers, more records in recent years, and a few
+# missing dates and locations). Every page is generated from the seed and its start index, so the same
+# request always returns the same records and nothing needs to be held in memory.
+
+# Import packages
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from nbn_api import FIELD_NAMES
+
+# Rough UK bounding box used to place the hotspots
+UK_LAT = (50.0, 58.5)
+UK_LON = (-6.0, 1.7)
+
+FIRST_YEAR = 1960
+LAST_YEAR = 2025
+
+DATA_RESOURCES = [
+    ("dr1", "National Otter Survey"),
+    ("dr2", "County Mammal Group records"),
+    ("dr3", "iRecord verified records"),
+    ("dr4", "Wildlife Trust river surveys"),
+]
+BASIS_OF_RECORD = ["HumanObservation", "PreservedSpecimen", "MachineObservation"]
+ASSERTIONS = ["coordinatesCentreOfCountry", "unknownKingdom", "firstOfMonth", "precisionRangeMismatch"]
+
+
+# Cluster centres (lat, lon) and relative weights, fixed for a seed
+def hotspots(seed=0, count=60):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(*UK_LAT, count)
+    lon = rng.uniform(*UK_LON, count)
+    weight = rng.pareto(1.5, count) + 1
+    return lat, lon, weight / weight.sum()
+
+
+# Synthetic occurrences with indices start .. start + count - 1, as a list of API-style dicts
+def generate_occurrences(start, count, seed=0):
+    rng = np.random.default_rng([seed, start])
+    centre_lat, centre_lon, weight = hotspots(seed)
+
+    # Location: scattered along a few km of "river" around a hotspot, often snapped to a 1km or 10km grid
+    centre = rng.choice(len(weight), count, p=weight)
+    along = rng.normal(0, 0.05, count)
+    lat = centre_lat[centre] + along + rng.normal(0, 0.01, count)
+    lon = centre_lon[centre] + along * rng.uniform(-1.5, 1.5, count) + rng.normal(0, 0.015, count)
+    precision = rng.choice([0.0001, 0.01, 0.1], count, p=[0.5, 0.35, 0.15])
+    lat = np.round(lat / precision) * precision
+    lon = np.round(lon / precision) * precision
+
+    # Date: more recording effort in recent years
+    year = LAST_YEAR - np.minimum(rng.exponential(12, count).astype(int), LAST_YEAR - FIRST_YEAR)
+    month = rng.choice(np.arange(1, 13), count, p=_month_weights())
+    day = rng.integers(1, 29, count)
+    months_since_epoch = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    event_ms = (months_since_epoch.astype("datetime64[D]") + (day - 1)).astype("datetime64[ms]").astype("int64")
+
+    no_date = rng.random(count) < 0.03
+    no_location = rng.random(count) < 0.02
+    resource = rng.integers(0, len(DATA_RESOURCES), count)
+    basis = rng.choice(len(BASIS_OF_RECORD), count, p=[0.95, 0.03, 0.02])
+
+    occurrences = []
+    for i in range(count):
+        index = start + i
+        record = {
+            "uuid": f"00000000-0000-4000-8000-{index:012d}",
+            "occurrenceID": f"SYN{index}",
+            "dataResourceUid": DATA_RESOURCES[resource[i]][0],
+            "dataResourceName": DATA_RESOURCES[resource[i]][1],
+            "dataProviderName": "Synthetic Provider",
+            "basisOfRecord": BASIS_OF_RECORD[basis[i]],
+            "scientificName": "Lutra lutra",
+            "vernacularName": "Eurasian Otter",
+            "taxonConceptID": "NHMSYS0000080188",
+            "taxonRank": "species",
+            "kingdom": "Animalia",
+            "phylum": "Chordata",
+            "classs": "Mammalia",
+            "order": "Carnivora",
+            "family": "Mustelidae",
+            "genus": "Lutra",
+            "species": "Lutra lutra",
+            "country": "United Kingdom",
+            "license": "CC-BY",
+            "collectors": [f"Recorder {index % 997}"],
+            "assertions": [ASSERTIONS[index % len(ASSERTIONS)]] if index % 5 == 0 else [],
+            "coordinateUncertaintyInMeters": float(precision[i] * 111_000 / 2),
+        }
+        if not no_date[i]:
+            record["eventDate"] = int(event_ms[i])
+            record["year"] = int(year[i])
+            record["month"] = f"{month[i]:02d}"
+        if not no_location[i]:
+            record["decimalLatitude"] = float(lat[i])
+            record["decimalLongitude"] = float(lon[i])
+        occurrences.append(record)
+    return occurrences
+
+
+# Otter sightings peak in spring and autumn
+def _month_weights():
+    weights = np.array([6, 6, 9, 10, 9, 7, 7, 8, 10, 11, 9, 8], dtype="float64")
+    return weights / weights.sum()
+
+
+# One search response page. With `fl`, only those fields are returned, as the real API does.
+def search_page(total, start, page_size, seed=0, fl=None):
+    count = max(0, min(page_size, total - start))
+    occurrences = generate_occurrences(start, count, seed) if count else []
+    if fl:
+        keep = {FIELD_NAMES.get(field, field) for field in fl.split(",")}
+        occurrences = [{key: value for key, value in record.items() if key in keep} for record in occurrences]
+    return {"pageSize": page_size, "startIndex": start, "totalRecords": total, "sort": "score",
+            "dir": "asc", "status": "OK", "occurrences": occurrences}
+
+
+# Response bodies for every page of a query, serialised up front and keyed by start index.
+# Serving these instead of generating each page on request keeps generation out of timed fetches.
+def page_bodies(total, page_size, seed=0, fl=None):
+    return {start: json.dumps(search_page(total, start, page_size, seed, fl)).encode()
+            for start in range(0, max(total, 1), page_size)}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_count = 0
+
+
+# Start a stub search API serving `total` records on a free local port.
+# Returns the server (with .request_count) and the search URL. Every `fail_every`-th request gets a 503.
+# Pages in `bodies` (see page_bodies) are served as they are, any others are generated on request.
+def start_stub_api(total, seed=0, fail_every=None, bodies=None):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                self.server.request_count += 1
+                request_number = self.server.request_count
+            if fail_every and request_number % fail_every == 0:
+                self.send_error(503)
+                return
+
+            query = parse_qs(urlparse(self.path).query)
+            start = int(query.get("startIndex", ["0"])[0])
+            page_size = int(query.get("pageSize", ["10"])[0])
+            fl = query.get("fl", [None])[0]
+            body = bodies.get(start) if bodies is not None else None
+            if body is None:
+                body = json.dumps(search_page(total, start, page_size, seed, fl)).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = StubServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, name="stub-nbn-api", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/occurrences/search"
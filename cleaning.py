@@ -0,0 +1,126 @@
+# This file turns the raw API records into the compact, cleaned frame every page reads from
+
+# Import packages
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from instrumentation import span
+from queries import DEFAULT_SPECIES, SPECIES
+from shared_frames import shared_frame
+
+# Columns in the cleaned frame
+CLEAN_COLUMNS = ['date', 'year', 'month', 'lat', 'lon', 'species']
+
+
+# Species of every row as a categorical. The categories are every species the dashboard knows, in the
+# same order for every frame, so frames for different species stay categorical when they're combined.
+def species_column(species, rows):
+    return pd.Categorical.from_codes(np.full(rows, list(SPECIES).index(species), dtype='int8'), categories=list(SPECIES))
+
+
+# Clean the raw occurrences of a species once: parse dates, validate coordinates and shrink dtypes.
+# Rows without a usable date are dropped, rows without a usable location keep NaN lat/lon
+# so date-only charts still count them.
+def clean_occurrences(raw, species=DEFAULT_SPECIES):
+    # There are some wierd date inputs, force these to numeric epoch milliseconds first
+    event_ms = pd.to_numeric(raw['eventDate'], errors='coerce')
+    date = pd.to_datetime(event_ms, unit='ms', errors='coerce')
+
+    lat = pd.to_numeric(raw['decimalLatitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    lon = pd.to_numeric(raw['decimalLongitude'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    # Latitude has to be within 90 and longitude within 180, anything else is treated as missing
+    invalid = (np.abs(lat) > 90) | (np.abs(lon) > 180) | ~np.isfinite(lat) | ~np.isfinite(lon)
+    lat = np.where(invalid, np.nan, lat)
+    lon = np.where(invalid, np.nan, lon)
+
+    df = pd.DataFrame({
+        'date': date.to_numpy(),
+        'lat': lat.astype('float32'),
+        'lon': lon.astype('float32'),
+    })
+    df = df[df['date'].notna()]
+    df = df.sort_values(by='date', kind='stable').reset_index(drop=True)
+
+    df['year'] = df['date'].dt.year.astype('int16')
+    df['month'] = df['date'].dt.month.astype('int16')
+    df['species'] = species_column(species, len(df))
+    return df[CLEAN_COLUMNS]
+
+
+# Rows dated from `start` (inclusive) up to `end` (exclusive) of a frame sorted by date.
+# Uses a binary search on the date column and returns a slice, so it's O(log n) and copies nothing.
+def time_window(df, start=None, end=None):
+    first = df['date'].searchsorted(pd.Timestamp(start), side='left') if start is not None else 0
+    last = df['date'].searchsorted(pd.Timestamp(end), side='left') if end is not None else len(df)
+    return df.iloc[first:last]
+
+
+# Window covering the last `years` years up to today
+def last_years(years, today=None):
+    today = pd.Timestamp.today().normalize() if today is None else pd.Timestamp(today)
+    return today - pd.DateOffset(years=years), None
+
+
+# Partition a frame sorted by date into years: returns (first year, offsets), where the rows for `year`
+# run from offsets[year - first] up to offsets[year - first + 1]. One binary search per year, nothing is copied.
+def year_partitions(df):
+    years = df['year'].to_numpy()
+    if len(years) == 0:
+        return 0, np.zeros(1, dtype='int64')
+    first, last = int(years[0]), int(years[-1])
+    return first, np.searchsorted(years, np.arange(first, last + 2), side='left')
+
+
+# Rows from `start_year` to `end_year` (both inclusive) as a slice, so it only costs the size of those years
+def year_range(df, partitions, start_year, end_year):
+    first, offsets = partitions
+    i = int(np.clip(start_year - first, 0, len(offsets) - 1))
+    j = int(np.clip(end_year - first + 1, i, len(offsets) - 1))
+    return df.iloc[offsets[i]:offsets[j]]
+
+
+# Only the rows with a valid location, for maps and hotspots
+def located_occurrences(clean):
+    return clean[clean['lat'].notna()].reset_index(drop=True)
+
+
+# Merge cleaned frames (e.g. one per species) into one, still sorted by date
+def combine_occurrences(frames):
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True).sort_values(by='date', kind='stable').reset_index(drop=True)
+
+
+# Cleaned frame shared by every session, rebuilt only when the dataset version changes.
+# It's memory-mapped from a snapshot file that every worker process shares (see shared_frames.py).
+@st.cache_resource(max_entries=16, show_spinner=False)
+def get_clean_occurrences(version, species, _raw):
+    def build():
+        with span("clean", rows=len(_raw)):
+            return clean_occurrences(_raw, species)
+    return shared_frame("clean", version, build)
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_located_occurrences(version, _clean):
+    return shared_frame("located", version, lambda: located_occurrences(_clean))
+
+
+# Merged cleaned frame for a set of dataset versions, shared by every session that picks the same set
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_combined_occurrences(versions, _frames):
+    if len(_frames) == 1:
+        return _frames[0]
+
+    def build():
+        with span("combine", rows=sum(len(frame) for frame in _frames)):
+            return combine_occurrences(list(_frames))
+    return shared_frame("combined", "+".join(versions), build)
+
+
+# Year partitions of a frame, worked out once per dataset version
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_year_partitions(version, _df):
+    return year_partitions(_df)
@@ -0,0 +1,244 @@
+# This file keeps a process-wide, on-disk Parquet cache of the NBN occurrences so sessions share one download
+
+# Import packages
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+import requests
+
+from instrumentation import span
+from nbn_api import fetch_occurrences
+
+CACHE_DIR = os.environ.get("OTTER_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# Cached data is served as-is for an hour, after that only newer records are fetched and merged in.
+# Once a week the whole query is pulled again to pick up edits and late additions to older records.
+CACHE_TTL_SECONDS = 60 * 60
+FULL_REFRESH_SECONDS = 7 * 24 * 60 * 60
+
+# A background refresher checks each query this often, and waits longer after a failed refresh
+REFRESH_POLL_SECONDS = 60
+REFRESH_RETRY_SECONDS = 5 * 60
+
+# In-memory copy of each cached query shared by every session in this process
+_memory = {}
+_locks = {}
+_locks_guard = threading.Lock()
+
+# Outcome of the latest refresh attempt per query, and the background refresher threads
+_status = {}
+_refreshers = {}
+
+
+# Stable key for a set of query parameters
+def cache_key(params):
+    blob = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()[:16]
+
+
+def _paths(key, cache_dir):
+    return os.path.join(cache_dir, f"{key}.parquet"), os.path.join(cache_dir, f"{key}.json")
+
+
+def _lock_for(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+# Sort by date and drop undated records, as the pages expect
+def _tidy(df):
+    df = df.dropna(subset=['eventDate'])
+    return df.sort_values(by='eventDate', ascending=True, kind='stable').reset_index(drop=True)
+
+
+# Some flattened API fields mix types (e.g. numbers and strings), which Arrow can't store - fall back to text
+def _arrow_safe(df):
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowException, TypeError, ValueError):
+            df[col] = df[col].map(lambda v: v if v is None or v != v else str(v))
+    return df
+
+
+# Write atomically so other processes never read a half-written file.
+# With no data frame only the metadata is rewritten, e.g. after a refresh that brought nothing new.
+def _write(df, meta, key, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = _paths(key, cache_dir)
+    tmp_data, tmp_meta = f"{data_path}.{os.getpid()}.tmp", f"{meta_path}.{os.getpid()}.tmp"
+    if df is not None:
+        _arrow_safe(df).to_parquet(tmp_data, index=False)
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    if df is not None:
+        os.replace(tmp_data, data_path)
+    os.replace(tmp_meta, meta_path)
+
+
+def _read(key, cache_dir):
+    data_path, meta_path = _paths(key, cache_dir)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return pd.read_parquet(data_path), meta
+    except (OSError, ValueError, pa.ArrowException):
+        return None, None
+
+
+# Add a date filter so only records on or after the newest cached event are requested
+def incremental_params(params, since_ms):
+    since = pd.to_datetime(since_ms, unit='ms').strftime('%Y-%m-%dT%H:%M:%SZ')
+    fq = params.get("fq", [])
+    fq = [fq] if isinstance(fq, str) else list(fq)
+    return dict(params, fq=fq + [f"occurrence_date:[{since} TO *]"])
+
+
+# Whether every fetched record is already cached exactly as it is (matched by uuid)
+def _already_cached(cached, new):
+    if 'uuid' not in cached or 'uuid' not in new or set(cached.columns) != set(new.columns):
+        return False
+    new = new.drop_duplicates(subset=['uuid'], keep='last').set_index('uuid')
+    old = cached[cached['uuid'].isin(new.index)]
+    if len(old) != len(new) or not old['uuid'].is_unique:
+        return False
+    return old.set_index('uuid').loc[new.index, new.columns].equals(new)
+
+
+# Merge newly fetched records into the cached frame, newest copy of each record wins.
+# Returns (data, changed) - if nothing was added or changed the cached frame comes back as it is.
+def merge(cached, new):
+    if new is None or new.empty or _already_cached(cached, new):
+        return cached, False
+    df = pd.concat([cached, new], ignore_index=True)
+    if 'uuid' in df:
+        df = df.drop_duplicates(subset=['uuid'], keep='last')
+    return _tidy(df), True
+
+
+# Return the occurrences for a query, using memory, then disk, then the API.
+# Only one thread per query refreshes at a time; the others wait and reuse its result.
+# If a refresh fails, the stale cached copy is served instead of nothing.
+# The metadata keeps when the query was last fetched ("fetched_at") and when that last brought new or
+# changed records ("updated_at") - only the latter changes the dataset version.
+def get_occurrences(params, ttl=CACHE_TTL_SECONDS, full_refresh=FULL_REFRESH_SECONDS,
+                    fetch=fetch_occurrences, cache_dir=CACHE_DIR):
+    key = cache_key(params)
+    with _lock_for(key):
+        df, meta = _memory.get(key, (None, None))
+        if df is None:
+            df, meta = _read(key, cache_dir)
+
+        now = time.time()
+        if df is not None and now - meta["fetched_at"] < ttl:
+            _memory[key] = (df, meta)
+            return df
+
+        try:
+            if df is not None and not df.empty and now - meta["full_fetched_at"] < full_refresh:
+                with span("cache.incremental_refresh") as record:
+                    new = fetch(incremental_params(params, df['eventDate'].max()))
+                    df, changed = merge(df, new)
+                    record["rows"] = len(new) if new is not None else 0
+                meta = dict(meta, fetched_at=now, updated_at=now if changed else _updated_at(meta))
+            else:
+                with span("cache.full_refresh") as record:
+                    new = fetch(params)
+                    if new is None:
+                        raise ValueError("The API returned no occurrences")
+                    df = _tidy(new)
+                    record["rows"] = len(df)
+                changed = True
+                meta = {"params": params, "fetched_at": now, "full_fetched_at": now, "updated_at": now}
+        except (requests.RequestException, ValueError) as e:
+            _status[key] = {"checked_at": now, "error": str(e)}
+            if df is not None:
+                _memory[key] = (df, meta)
+            return df
+
+        with span("cache.write", rows=len(df) if changed else 0):
+            _write(df if changed else None, meta, key, cache_dir)
+        _memory[key] = (df, meta)
+        _status[key] = {"checked_at": now, "error": None}
+        return df
+
+
+# Latest cached snapshot of a query without waiting on any refresh in progress, as (data, metadata)
+def peek(params, cache_dir=CACHE_DIR):
+    key = cache_key(params)
+    if key in _memory:
+        return _memory[key]
+    df, meta = _read(key, cache_dir)
+    if df is None:
+        return None, None
+    return _memory.setdefault(key, (df, meta))
+
+
+# Keep a query fresh from a background thread, re-pulling it once the cache is older than `ttl`.
+# New data is swapped in whole, so readers always see either the old or the new snapshot.
+# A failed refresh leaves the previous snapshot in place and is retried after REFRESH_RETRY_SECONDS.
+def start_refresher(params, ttl=CACHE_TTL_SECONDS, fetch=fetch_occurrences, cache_dir=CACHE_DIR):
+    key = cache_key(params)
+    with _locks_guard:
+        thread = _refreshers.get(key)
+        if thread is not None and thread.is_alive():
+            return thread
+
+        def refresh_loop():
+            while True:
+                get_occurrences(params, ttl=ttl, fetch=fetch, cache_dir=cache_dir)
+                failed = _status.get(key, {}).get("error") is not None
+                time.sleep(REFRESH_RETRY_SECONDS if failed else REFRESH_POLL_SECONDS)
+
+        thread = threading.Thread(target=refresh_loop, name=f"refresh-{key}", daemon=True)
+        _refreshers[key] = thread
+        thread.start()
+        return thread
+
+
+# Serve the latest snapshot straight away (stale-while-revalidate) and leave refreshing to the background.
+# Only a cold start with nothing cached waits for the API. Returns (data, dataset version).
+def get_snapshot(params, ttl=CACHE_TTL_SECONDS, fetch=fetch_occurrences, cache_dir=CACHE_DIR):
+    df, meta = peek(params, cache_dir)
+    if df is None:
+        df = get_occurrences(params, ttl=ttl, fetch=fetch, cache_dir=cache_dir)
+        df, meta = peek(params, cache_dir)
+    start_refresher(params, ttl=ttl, fetch=fetch, cache_dir=cache_dir)
+    if df is None:
+        return None, None
+    return df, _version(cache_key(params), meta)
+
+
+# Outcome of the latest refresh of a query: {"checked_at": time, "error": message or None}, if any
+def refresh_status(params):
+    return _status.get(cache_key(params))
+
+
+# When a query was last fetched from the API, whether or not that brought anything new (None if never)
+def fetched_at(params, cache_dir=CACHE_DIR):
+    meta = peek(params, cache_dir)[1]
+    return meta["fetched_at"] if meta is not None else None
+
+
+# Caches written before "updated_at" was kept count as updated at their last fetch
+def _updated_at(meta):
+    return meta.get("updated_at", meta["fetched_at"])
+
+
+# Identifier that changes every time a query's cached data changes, made of
+# "<query key>-<last full fetch time>-<last time new or changed records came in>"
+def _version(key, meta):
+    return f"{key}-{int(meta['full_fetched_at'])}-{int(_updated_at(meta))}"
+
+
+# Split a dataset version back into (query key, full fetch time, update time).
+# Two versions with the same key and full fetch time differ only by records appended by incremental refreshes.
+def parse_version(version):
+    key, full_fetched_at, updated_at = version.split("-")
+    return key, int(full_fetched_at), int(updated_at)
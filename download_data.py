@@ -0,0 +1,78 @@
+# import packages
+
+import streamlit as st
+import pandas as pd
+from cleaning import time_window
+from export import EXPORT_FORMATS, MAX_IN_MEMORY_EXPORT_ROWS, count_rows, export_bytes, export_filename, export_server_running, export_url
+from hotspots import find_hotspots
+from instrumentation import span
+
+# add page title and description
+st.write("### Download Data")
+st.markdown("*Download the cleaned sightings behind the charts, with the species of each, filtered by date, area or hotspot. Dates are parsed and invalid locations removed as described on the Insights & Recommendations page.*")
+
+# get cleaned data from session state (sorted by date, see cleaning.py)
+if st.session_state.otter_clean is not None:
+    df = st.session_state.otter_clean
+
+else:
+    st.error("Failed to load data.")
+    st.stop()
+
+# Busiest hotspots in a date range, cached per dataset version and range
+@st.cache_data(max_entries=16, show_spinner=False)
+def range_hotspots(version, start, end, _df):
+    rows = time_window(_df, start, end)
+    rows = rows[rows['lat'].notna()]
+    return find_hotspots(rows['lat'], rows['lon'], top_n=5)
+
+# Rows an export will have, cached per dataset version and filters
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_rows(version, start, end, bbox, hotspot, _df):
+    return count_rows(_df, start=start, end=end, bbox=bbox, hotspot=hotspot)
+
+# Step 1: Choose the date range - everything by default
+first_date = df['date'].iloc[0].date()
+last_date = df['date'].iloc[-1].date()
+date_range = st.date_input("Date range", value=(first_date, last_date), min_value=first_date, max_value=last_date)
+start = pd.Timestamp(date_range[0])
+end = pd.Timestamp(date_range[1] if len(date_range) > 1 else last_date) + pd.Timedelta(days=1)
+
+# Step 2: Optionally limit to an area
+bbox = None
+if st.checkbox("Limit to an area"):
+    col1, col2, col3, col4 = st.columns(4)
+    min_lat = col1.number_input("Min latitude", -90.0, 90.0, 49.8)
+    max_lat = col2.number_input("Max latitude", -90.0, 90.0, 60.9)
+    min_lon = col3.number_input("Min longitude", -180.0, 180.0, -8.7)
+    max_lon = col4.number_input("Max longitude", -180.0, 180.0, 1.8)
+    bbox = (min_lon, min_lat, max_lon, max_lat)
+
+# Step 3: Optionally limit to one of the busiest hotspots in the date range (see hotspots.py)
+with span("download.hotspots"):
+    hotspots = range_hotspots(st.session_state.otter_version, start, end, df)
+hotspot_labels = {None: "Any"}
+for idx, row in hotspots.iterrows():
+    hotspot_labels[row['cells']] = f"Hotspot {idx + 1} near {row['lat']:.3f}, {row['lon']:.3f} ({int(row['Sightings']):,} sightings)"
+hotspot = st.selectbox("Hotspot", list(hotspot_labels), format_func=hotspot_labels.get)
+
+# Step 4: Choose the format and download
+fmt = st.radio("Format", ["csv", "parquet"], format_func=str.upper, horizontal=True)
+filters = {"start": start, "end": end, "bbox": bbox, "hotspot": hotspot}
+with span("download.count"):
+    rows = export_rows(st.session_state.otter_version, start, end, bbox, hotspot, df)
+st.markdown(f"*{rows:,} sightings match.*")
+
+if export_server_running():
+    # Streamed by the export server a chunk at a time (see export.py)
+    st.link_button("Download", export_url(st.session_state.otter_version, fmt, **filters))
+elif rows > MAX_IN_MEMORY_EXPORT_ROWS:
+    # Without the export server the file is built here in full, so keep it to a manageable size
+    st.warning(f"Downloads here are limited to {MAX_IN_MEMORY_EXPORT_ROWS:,} sightings. Narrow the date range, area or hotspot to download these.")
+elif st.button("Prepare download"):
+    with span(f"download.{fmt}", rows=rows):
+        data = export_bytes(df, fmt, **filters)
+    mime, _ = EXPORT_FORMATS[fmt]
+    st.download_button("Download", data, file_name=export_filename(st.session_state.otter_species, fmt), mime=mime)
+
+st.markdown("*Showing live data from National Biodiversity Network Trust Atlas API.*")
@@ -0,0 +1,265 @@
+# This file streams filtered sightings out as CSV or Parquet, a chunk at a time
+#
+# Exports are generated chunk by chunk from the shared cleaned frame (see shared_frames.py), so memory per
+# export stays at about one chunk however many rows match. With OTTER_EXPORT_PORT set, a small HTTP server
+# streams them straight to the browser from its own threads, so a long export doesn't hold up any session.
+# OTTER_EXPORT_URL has to be set with it, to the address the browser reaches the server at. Without the
+# server, the download page builds the file in memory instead, for exports up to MAX_IN_MEMORY_EXPORT_ROWS.
+
+# Import packages
+import io
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from cleaning import time_window
+from hotspots import hotspot_mask
+from instrumentation import span
+from shared_frames import map_frame, snapshot_path
+
+EXPORT_PORT = os.environ.get("OTTER_EXPORT_PORT")
+# Address the browser reaches the export server on, e.g. https://dashboard.example.org/downloads behind a proxy
+EXPORT_URL = os.environ.get("OTTER_EXPORT_URL")
+
+# Rows converted per chunk
+EXPORT_CHUNK_ROWS = 20_000
+
+# Exports streamed at the same time per process, any more are asked to retry
+MAX_CONCURRENT_EXPORTS = 2
+
+# Largest export built in memory when there's no export server. It's built on the session's own thread and
+# held whole until it's downloaded, so bigger ones have to be narrowed down first.
+MAX_IN_MEMORY_EXPORT_ROWS = 250_000
+
+# Content type and file extension of each format
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+_export_slots = threading.BoundedSemaphore(MAX_CONCURRENT_EXPORTS)
+_server = None
+_server_error = None
+_server_lock = threading.Lock()
+
+
+# Filtered rows of a cleaned frame, a chunk at a time. The date range (end exclusive) is a slice of the
+# date-sorted frame, and the area (min_lon, min_lat, max_lon, max_lat) and hotspot (the (x, y) cells from
+# find_hotspots) are applied to each chunk, so nothing the size of the whole export is ever built.
+def iter_chunks(df, start=None, end=None, bbox=None, hotspot=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    rows = time_window(df, start, end)
+    for first in range(0, len(rows), chunk_rows):
+        chunk = rows.iloc[first:first + chunk_rows]
+        keep = np.ones(len(chunk), dtype=bool)
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            lat, lon = chunk['lat'].to_numpy(), chunk['lon'].to_numpy()
+            keep &= (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        if hotspot is not None:
+            keep &= hotspot_mask(chunk['lat'], chunk['lon'], hotspot)
+        if keep.any():
+            yield chunk[keep]
+
+
+# Number of rows an export would have
+def count_rows(df, **filters):
+    return sum(len(chunk) for chunk in iter_chunks(df, **filters))
+
+
+# CSV bytes, one piece per chunk
+def iter_csv(chunks, empty):
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header, date_format='%Y-%m-%d').encode()
+        header = False
+    if header:
+        yield empty.to_csv(index=False).encode()
+
+
+# Collects what the Parquet writer writes so it can be handed on a piece at a time
+class _StreamSink:
+    def __init__(self):
+        self.pieces = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.pieces.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.pieces)
+        self.pieces = []
+        return data
+
+
+# Parquet bytes, one row group per chunk
+def iter_parquet(chunks, empty):
+    sink = _StreamSink()
+    writer = None
+    for chunk in chunks:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is None:
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), pa.Table.from_pandas(empty, preserve_index=False).schema)
+    writer.close()
+    yield sink.drain()
+
+
+# The export file as a stream of bytes
+def iter_export(df, fmt, **filters):
+    chunks = iter_chunks(df, **filters)
+    if fmt == "parquet":
+        return iter_parquet(chunks, df.iloc[:0])
+    return iter_csv(chunks, df.iloc[:0])
+
+
+# Whole export file in memory, for when there's no export server
+def export_bytes(df, fmt, **filters):
+    buffer = io.BytesIO()
+    for piece in iter_export(df, fmt, **filters):
+        buffer.write(piece)
+    return buffer.getvalue()
+
+
+# Species with any rows in a cleaned frame, in the dashboard's order
+def frame_species(df):
+    categories = df['species'].cat.categories
+    counts = np.bincount(df['species'].cat.codes.to_numpy().astype('int64'), minlength=len(categories))
+    return list(categories[counts > 0])
+
+
+# File name for an export, after the species in it, e.g. otter_sightings.csv or otter_badger_sightings.parquet
+def export_filename(species, fmt):
+    names = "_".join(name.lower().replace(" ", "_") for name in species) or "nbn"
+    return f"{names}_sightings.{EXPORT_FORMATS[fmt][1]}"
+
+
+# Query string for an export from the server, see _ExportHandler
+def export_query(version, fmt, start=None, end=None, bbox=None, hotspot=None):
+    query = {"version": version, "format": fmt}
+    if start is not None:
+        query["start"] = pd.Timestamp(start).strftime('%Y-%m-%d')
+    if end is not None:
+        query["end"] = pd.Timestamp(end).strftime('%Y-%m-%d')
+    if bbox is not None:
+        query["bbox"] = ",".join(str(value) for value in bbox)
+    if hotspot is not None:
+        query["hotspot"] = ";".join(f"{x},{y}" for x, y in hotspot)
+    return urlencode(query)
+
+
+# Link to an export from the server
+def export_url(version, fmt, **filters):
+    return f"{EXPORT_URL.rstrip('/')}/export?{export_query(version, fmt, **filters)}"
+
+
+# Cleaned frame for a dataset version (single or combined species), from its shared snapshot
+def _exported_frame(version):
+    for name in ("clean", "combined"):
+        path = snapshot_path(name, version)
+        if os.path.exists(path):
+            return map_frame(path)
+    return None
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/export":
+            self.send_error(404)
+            return
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            fmt = query.get("format", "csv")
+            content_type, _ = EXPORT_FORMATS[fmt]
+            filters = {
+                "start": pd.Timestamp(query["start"]) if "start" in query else None,
+                "end": pd.Timestamp(query["end"]) if "end" in query else None,
+                "bbox": tuple(float(v) for v in query["bbox"].split(",")) if "bbox" in query else None,
+                "hotspot": tuple(tuple(int(v) for v in cell.split(",")) for cell in query["hotspot"].split(";"))
+                           if "hotspot" in query else None,
+            }
+            # Anything malformed has to be turned away here, once the download has started it can't be
+            if filters["bbox"] is not None and len(filters["bbox"]) != 4:
+                raise ValueError("bbox needs 4 values")
+            if filters["hotspot"] is not None and any(len(cell) != 2 for cell in filters["hotspot"]):
+                raise ValueError("hotspot cells need 2 values")
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+
+        df = _exported_frame(query.get("version"))
+        if df is None:
+            self.send_error(404, "Unknown or expired dataset version, reload the dashboard")
+            return
+
+        if not _export_slots.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Retry-After", "10")
+            self.end_headers()
+            return
+        try:
+            # No Content-Length, the file is written as it's generated and the connection closed at the end
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Disposition", f'attachment; filename="{export_filename(frame_species(df), fmt)}"')
+            self.end_headers()
+            with span(f"export.{fmt}"):
+                for piece in iter_export(df, fmt, **filters):
+                    self.wfile.write(piece)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            _export_slots.release()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /export on a port from background threads (once per process).
+# If there's no OTTER_EXPORT_URL to link to, or the port can't be bound (e.g. another worker on the host has
+# it), the failure is logged once and remembered, and downloads are built in memory instead.
+def start_export_server(port, url=None):
+    global _server, _server_error
+    url = url or EXPORT_URL
+    with _server_lock:
+        if _server is None and _server_error is None:
+            if not url:
+                _server_error = "OTTER_EXPORT_URL isn't set"
+            else:
+                try:
+                    _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _ExportHandler)
+                except OSError as e:
+                    _server_error = e
+            if _server_error is not None:
+                logging.getLogger(__name__).warning("Export server not started on port %s: %s", port, _server_error)
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="export", daemon=True).start()
+    return _server
+
+
+# Whether downloads are streamed by the export server in this process
+def export_server_running():
+    return _server is not None
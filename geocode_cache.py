@@ -0,0 +1,146 @@
+# This file keeps a persistent cache of reverse-geocoded locality names and looks up new ones in the background
+
+# Import packages
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import streamlit as st
+
+from data_cache import CACHE_DIR
+
+DB_PATH = os.path.join(CACHE_DIR, "localities.sqlite")
+
+# Coordinates are rounded to 3 decimal places (about 100m) before lookup
+PRECISION = 3
+
+# "Unknown" answers are re-tried after 30 days, failed lookups (e.g. network errors) after an hour
+UNKNOWN_TTL_SECONDS = 30 * 24 * 60 * 60
+ERROR_TTL_SECONDS = 60 * 60
+
+UNKNOWN = "Unknown"
+
+# Address fields to use as the locality name, in order of preference
+LOCALITY_KEYS = ['city', 'town', 'village', 'hamlet']
+
+
+# Pick the locality name out of a geopy location
+def locality_from_location(location):
+    if location:
+        for key in LOCALITY_KEYS:
+            if key in location.raw.get('address', {}):
+                return location.raw['address'][key]
+    return UNKNOWN
+
+
+# Nominatim reverse geocoder limited to one request a second, as the usage policy asks
+def nominatim_reverse():
+    from geopy.geocoders import Nominatim
+    from geopy.extra.rate_limiter import RateLimiter
+
+    geolocator = Nominatim(user_agent="hotspot-locality-mapper")
+    return RateLimiter(geolocator.reverse, min_delay_seconds=1)
+
+
+class LocalityCache:
+    # `reverse` is called as reverse((lat, lon), exactly_one=True, language='en') and returns a geopy location
+    def __init__(self, reverse=None, db_path=DB_PATH, precision=PRECISION):
+        self._reverse = reverse
+        self.precision = precision
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS localities ("
+            "lat REAL, lon REAL, locality TEXT, expires_at REAL, PRIMARY KEY (lat, lon))"
+        )
+        self._db.commit()
+        self._db_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._worker = None
+
+    def _key(self, lat, lon):
+        return round(float(lat), self.precision), round(float(lon), self.precision)
+
+    # Cached locality for a coordinate, or None if it hasn't been looked up (or the cached answer expired)
+    def get(self, lat, lon):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT locality, expires_at FROM localities WHERE lat = ? AND lon = ?", self._key(lat, lon)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def _store(self, key, locality, ttl):
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO localities VALUES (?, ?, ?, ?)", (*key, locality, expires_at))
+            self._db.commit()
+
+    # Look a coordinate up now and cache the answer
+    def resolve(self, lat, lon):
+        key = self._key(lat, lon)
+        if self._reverse is None:
+            self._reverse = nominatim_reverse()
+        try:
+            locality = locality_from_location(self._reverse(key, exactly_one=True, language='en'))
+        except Exception:
+            self._store(key, UNKNOWN, ERROR_TTL_SECONDS)
+            return UNKNOWN
+        self._store(key, locality, UNKNOWN_TTL_SECONDS if locality == UNKNOWN else None)
+        return locality
+
+    # Queue uncached coordinates for lookup in the background
+    def prefetch(self, coords):
+        for lat, lon in coords:
+            key = self._key(lat, lon)
+            if self.get(*key) is not None:
+                continue
+            with self._pending_lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._queue.put(key)
+        self._start_worker()
+
+    # Cached localities for a list of coordinates, None for any still being looked up.
+    # Misses are queued for the background worker so the caller never waits on the geocoder.
+    def lookup(self, coords):
+        coords = list(coords)
+        self.prefetch(coords)
+        return [self.get(lat, lon) for lat, lon in coords]
+
+    # Whether any lookups are still queued or running
+    def busy(self):
+        with self._pending_lock:
+            return bool(self._pending)
+
+    # Block until the queued lookups are done (used by scripts and tests)
+    def wait(self):
+        self._queue.join()
+
+    def _start_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="locality-lookup", daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            try:
+                if self.get(*key) is None:
+                    self.resolve(*key)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(key)
+                self._queue.task_done()
+
+
+# Locality cache shared by every session in this process
+@st.cache_resource(show_spinner=False)
+def get_locality_cache():
+    return LocalityCache()
@@ -1,21 +1,11 @@
 # Import packages
-from PIL import Image
-import requests
-from io import BytesIO
+# Only what this page uses - Streamlit runs every page on each visit, so unused heavy libraries slow it down
 import streamlit as st
-import pandas as pd
-import requests
-import matplotlib.pyplot as plt
-import folium
-from folium.plugins import MarkerCluster
-import altair as alt
-import numpy as np
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
+from assets import HERO_IMAGE_URL, get_hero_image
+from instrumentation import span
 
 
-# Set up page layout with Mammal Society logo in the sidebar
-st.set_page_config(layout="wide")
+# Mammal Society logo in the sidebar
 # st.sidebar.markdown("""
 #     <div style="text-align: center;">
 #         <img src="https://images.squarespace-cdn.com/content/v1/654a3265fcbd755384b0552f/5cc2d0e2-dd55-449f-ae3a-949ab6871318/MSlogo_colour_strapblue_L-800px.jpeg?format=1500w" alt="Logo" width="100"/>
@@ -35,23 +25,15 @@ col1, col2 = st.columns(2)
 # Add content
 with col1:
 
-    # Add otter image
-    otter_image_url = "https://images.squarespace-cdn.com/content/v1/654a3265fcbd755384b0552f/a9312805-4ca9-4994-9879-c6f9e1c5338f/Otter+on+Skye+by+Sophie+Hall+2.JPG?format=2500w"  # Replace with your actual otter image URL
-    # Make a request to get the image
-    response = requests.get(otter_image_url)
+    # Add otter image - resized once and kept on disk (see assets.py)
+    with span("home.image"):
+        image = get_hero_image()
 
-    # Open the image using Pillow
-    image = Image.open(BytesIO(response.content))
-
-    # Resize the image by setting the height to 400px (adjust as needed)
-    new_height = 900
-    new_width = int(image.width * (new_height / image.height))
-
-    # Resize the image
-    image_resized = image.resize((new_width, new_height))
-
-    # Display the resized image
-    st.image(image_resized)
+    # Display the resized image, or let the browser load the original if it couldn't be prepared
+    if image is not None:
+        st.image(image)
+    else:
+        st.image(HERO_IMAGE_URL)
 
 with col2:
     
@@ -0,0 +1,117 @@
+# This file finds sighting hotspots by clustering nearby records rather than grouping exact coordinates
+
+# Import packages
+import numpy as np
+import pandas as pd
+
+from aggregates import UK_LAT
+
+# Hotspots are built from 3x3 blocks of square grid cells this wide, so a block is about 6km across.
+# The grid is fixed, so a cluster of sightings can straddle blocks - blocks that touch are merged into one hotspot.
+HOTSPOT_CELL_KM = 2.0
+
+# Blocks picked for each hotspot asked for, before touching ones are merged
+CANDIDATE_BLOCKS_PER_HOTSPOT = 4
+
+KM_PER_DEGREE = 111.32
+
+# The 3x3 block of grid cells around (and including) a cell
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+# Find the `top_n` busiest clusters of sightings.
+# Points are hashed into square cells (a geohash-style grid index), so each cell's neighbourhood is just the
+# 3x3 block around it. The cell with the busiest neighbourhood seeds a block, the block takes the unclaimed
+# cells in it, and the search repeats on what's left. Blocks that touch are then merged, so a cluster split
+# by the grid counts as one hotspot, and the merged hotspots are ranked. Everything is vectorised over
+# occupied cells, so the cost is one pass over the points plus a few passes over the cells per block.
+# Returns the centroid (mean lat/lon of member sightings) and size of each hotspot, busiest first,
+# plus the grid cells it claimed as a tuple of (x, y) pairs (see hotspot_mask).
+def find_hotspots(lat, lon, cell_km=HOTSPOT_CELL_KM, top_n=5, ref_lat=UK_LAT):
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    if lat.size == 0:
+        return pd.DataFrame({'lat': [], 'lon': [], 'Sightings': [], 'cells': []})
+
+    # Grid cell for every point, in roughly square cells on the ground
+    cell_x, cell_y = _grid_cells(lat, lon, cell_km, ref_lat)
+
+    # Per-cell totals, keyed by a single integer per cell
+    span = int(cell_y.max() - cell_y.min()) + 3
+    offset_y = int(cell_y.min()) - 1
+    keys = cell_x * span + (cell_y - offset_y)
+    cells = pd.DataFrame({'key': keys, 'lat': lat, 'lon': lon}).groupby('key').agg(
+        count=('lat', 'size'), lat_sum=('lat', 'sum'), lon_sum=('lon', 'sum'))
+    cell_keys = cells.index.to_numpy()
+    counts = cells['count'].to_numpy().astype('int64')
+
+    # Index of each cell's neighbours (-1 where the neighbouring cell is empty)
+    index = pd.Index(cell_keys)
+    neighbours = np.stack([index.get_indexer(cell_keys + dx * span + dy) for dx, dy in _NEIGHBOURS], axis=1)
+    has_neighbour = neighbours >= 0
+
+    # Block each cell was claimed by, -1 if none
+    block = np.full(len(cell_keys), -1)
+    blocks = 0
+    for _ in range(top_n * CANDIDATE_BLOCKS_PER_HOTSPOT):
+        available = block < 0
+        if not available.any():
+            break
+        # Sightings in each available cell's neighbourhood that haven't been claimed by a block yet
+        live = np.where(has_neighbour, available[np.where(has_neighbour, neighbours, 0)], False)
+        neighbourhood = np.where(live, counts[np.where(has_neighbour, neighbours, 0)], 0).sum(axis=1)
+        neighbourhood[~available] = -1
+
+        seed = int(np.argmax(neighbourhood))
+        block[neighbours[seed][live[seed]]] = blocks
+        blocks += 1
+
+    # Merge blocks with cells next to each other
+    group = list(range(blocks))
+
+    def root(i):
+        while group[i] != i:
+            i = group[i]
+        return i
+
+    claimed = np.flatnonzero(block >= 0)
+    touching = np.where(has_neighbour[claimed], block[np.where(has_neighbour[claimed], neighbours[claimed], 0)], -1)
+    for a, b in zip(np.repeat(block[claimed], touching.shape[1]), touching.ravel()):
+        if b >= 0 and root(a) != root(b):
+            group[root(b)] = root(a)
+
+    hotspots = []
+    for g in sorted({root(i) for i in range(blocks)}):
+        members = claimed[[root(i) == g for i in block[claimed]]]
+        total = counts[members].sum()
+        hotspots.append({
+            'lat': cells['lat_sum'].to_numpy()[members].sum() / total,
+            'lon': cells['lon_sum'].to_numpy()[members].sum() / total,
+            'Sightings': int(total),
+            'cells': tuple((int(key // span), int(key % span) + offset_y) for key in sorted(cell_keys[members])),
+        })
+
+    hotspots.sort(key=lambda hotspot: -hotspot['Sightings'])
+    return pd.DataFrame(hotspots[:top_n], columns=['lat', 'lon', 'Sightings', 'cells'])
+
+
+# Which points fall in a hotspot, i.e. in one of the cells it claimed (from find_hotspots' 'cells').
+# Cells next to the seed that an earlier, busier block claimed aren't part of it, so neither are their points.
+def hotspot_mask(lat, lon, cells, cell_km=HOTSPOT_CELL_KM, ref_lat=UK_LAT):
+    x, y = _grid_cells(np.asarray(lat, dtype='float64'), np.asarray(lon, dtype='float64'), cell_km, ref_lat)
+    cells = np.asarray(cells, dtype='int64').reshape(-1, 2)
+    return np.isin(_cell_keys(x, y), _cell_keys(cells[:, 0], cells[:, 1]))
+
+
+# One integer per (x, y) cell
+def _cell_keys(x, y):
+    return x * 2 ** 32 + y
+
+
+def _grid_cells(lat, lon, cell_km, ref_lat):
+    x = lon * np.cos(np.radians(ref_lat)) * KM_PER_DEGREE
+    y = lat * KM_PER_DEGREE
+    # NaN locations get a cell far from everything, so they never match
+    x = np.nan_to_num(np.floor(x / cell_km), nan=np.iinfo('int32').min)
+    y = np.nan_to_num(np.floor(y / cell_km), nan=np.iinfo('int32').min)
+    return x.astype('int64'), y.astype('int64')
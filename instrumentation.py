@@ -0,0 +1,152 @@
+# This file times each stage of the data pipeline and page rendering, and reports the timings
+#
+# Timings are reported three ways:
+# - a JSON log line per stage on the "otter.timing" logger (printed to stderr with OTTER_TIMING_LOG=1)
+# - running totals in Prometheus text format, served on OTTER_METRICS_PORT if it's set
+# - a sidebar debug panel for the current rerun, shown with ?debug=1 in the URL or OTTER_DEBUG=1
+
+# Import packages
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+logger = logging.getLogger("otter.timing")
+
+METRICS_PORT = os.environ.get("OTTER_METRICS_PORT")
+DEBUG = os.environ.get("OTTER_DEBUG") == "1"
+
+# Timing log lines go to stderr when OTTER_TIMING_LOG=1
+if os.environ.get("OTTER_TIMING_LOG") == "1" and not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+# Stages timed during the current rerun of each session (Streamlit runs a session's script on one thread)
+_local = threading.local()
+
+# Running totals per stage for the whole process
+_totals = {}
+_totals_lock = threading.Lock()
+_server = None
+_server_error = None
+
+
+# Time a block of code as a named stage. Set record["rows"] inside the block to report rows processed.
+@contextmanager
+def span(stage, rows=None):
+    record = {"stage": stage, "rows": rows}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _record(record)
+
+
+def _record(record):
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append(record)
+
+    with _totals_lock:
+        totals = _totals.setdefault(record["stage"], {"count": 0, "seconds": 0.0, "rows": 0})
+        totals["count"] += 1
+        totals["seconds"] += record["seconds"]
+        totals["rows"] += record["rows"] or 0
+
+    logger.info(json.dumps({"stage": record["stage"], "ms": round(record["seconds"] * 1000, 2), "rows": record["rows"]}))
+
+
+# Start collecting the stages of a new rerun
+def start_rerun():
+    _local.spans = []
+
+
+# Stages timed so far in this rerun
+def rerun_spans():
+    return list(getattr(_local, "spans", []))
+
+
+# Running totals in Prometheus text exposition format
+def prometheus_text():
+    with _totals_lock:
+        totals = {stage: dict(values) for stage, values in _totals.items()}
+    lines = [
+        "# HELP otter_stage_seconds Time spent in each pipeline or page stage.",
+        "# TYPE otter_stage_seconds summary",
+    ]
+    for stage, values in sorted(totals.items()):
+        lines.append(f'otter_stage_seconds_sum{{stage="{stage}"}} {values["seconds"]:.6f}')
+        lines.append(f'otter_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+    lines += [
+        "# HELP otter_stage_rows_total Rows processed by each pipeline or page stage.",
+        "# TYPE otter_stage_rows_total counter",
+    ]
+    for stage, values in sorted(totals.items()):
+        lines.append(f'otter_stage_rows_total{{stage="{stage}"}} {values["rows"]}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /metrics on a port from a background thread (once per process).
+# If the port can't be bound (e.g. another worker on the host has it) the failure is logged once and
+# remembered, so the app carries on without metrics rather than failing or retrying on every rerun.
+def start_metrics_server(port):
+    global _server, _server_error
+    with _totals_lock:
+        if _server is None and _server_error is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", int(port)), _MetricsHandler)
+            except OSError as e:
+                _server_error = e
+                logging.getLogger(__name__).warning("Metrics server not started on port %s: %s", port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+# Whether the debug panel was asked for
+def debug_enabled():
+    import streamlit as st
+
+    return DEBUG or st.query_params.get("debug") == "1"
+
+
+# Sidebar table of the stages timed in this rerun, plus the memory used by the given data frames
+def render_debug_panel(frames):
+    import streamlit as st
+
+    with st.sidebar.expander("Debug: timings", expanded=True):
+        spans = rerun_spans()
+        if spans:
+            st.dataframe(pd.DataFrame({
+                "stage": [s["stage"] for s in spans],
+                "ms": [round(s["seconds"] * 1000, 1) for s in spans],
+                "rows": [s["rows"] for s in spans],
+            }), hide_index=True, use_container_width=True)
+        memory = {
+            name: round(frame.memory_usage(deep=True).sum() / 1024 ** 2, 1)
+            for name, frame in frames.items() if frame is not None
+        }
+        st.dataframe(pd.DataFrame({"frame": list(memory), "MB": list(memory.values())}),
+                     hide_index=True, use_container_width=True)
@@ -1,13 +1,11 @@
 # Import packages
 
 import streamlit as st
-import pandas as pd
-import requests
 import pydeck as pdk
 import numpy as np
-
-# Set page layout
-st.set_page_config(layout="wide")
+from aggregates import BIN_MODES, MAX_POINTS_PER_MAP, binned_points
+from cleaning import get_year_partitions, year_range
+from instrumentation import span
 
 # Add Mammal Society logo to side bar
 # st.sidebar.markdown("""
@@ -17,84 +15,98 @@ st.set_page_config(layout="wide")
 # """, unsafe_allow_html=True)
 
 # Add header and page description
-st.write("### Otter Sightings Over Time (Map Visual)")
-st.markdown("*This visual shows a series of maps of the UK over a 15 year period. The red dots indicate instances of an otter sighting, with a higher colour density indicating more sightings that year. From this we can potentially look at changes in otter population numbers geographically, though important consideration must be given to the fact that this is recorded otter sightings and not necessarily a reflection of otter populations.*")
-
-# Check for successful request
-if st.session_state.otter_data is not None:
-    df = st.session_state.otter_data
-        
-    # Order by date
-    df_sorted = df.sort_values(by='eventDate', ascending=True)
-    
-    # Drop missing event dates and convert to datetime
-    df = df_sorted.dropna(subset=['eventDate'])
-    df['date'] = pd.to_datetime(df['eventDate'], unit='ms')
-    
-    # Extract year for filtering
-    df['year'] = df['date'].dt.year  
-    
-    # Create lat/lon column streamlit recognises
-    df['lat'] = df['decimalLatitude']
-    df['lon'] = df['decimalLongitude']
-
-    # Remove invalid lat/lon (Latitude has to be greater than 90 and longitude greater than 180)
-    invalid_lat_lon = df[(df['lat'].abs() > 90) | (df['lon'].abs() > 180) | 
-                    (~np.isfinite(df['lat'])) | (~np.isfinite(df['lon']))]
-    
-    # Convert lat and lon columns to numeric values
-    df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
-    df['lon'] = pd.to_numeric(df['lon'], errors='coerce')
-
-    # Drop null lat and lon
-    df = df.dropna(subset=['lat', 'lon'])
-    # df = df[(df['lat'].abs() <= 90) & (df['lon'].abs() <= 180)]
-    # df = df[np.isfinite(df['lat']) & np.isfinite(df['lon'])]
-
-    # Select the years 2021, 2022, 2023, 2024 for the grid
-    years = [2009, 2014, 2019, 2024]
-    
-    # set up columns
-    cols = st.columns(4)  
-
-    # loop through the years plotting a map for each one
-    for idx, year in enumerate(years):
-        # Filter data by year
-        df_filtered = df[df['year'] == year]
-
-        # Group sightings by date and location
-        sightings_by_year = df_filtered.groupby(['date', 'lat', 'lon']).size().reset_index(name='count')
-
-        # Normalize the count to ensure no overflow in radius calculations
+st.write(f"### {st.session_state.species_label} Sightings Over Time (Map Visual)")
+st.markdown("*This visual shows maps of the UK for any year or range of years you pick, followed by a series of maps over a 15 year period. The red dots indicate sightings, with a higher colour density indicating more sightings that year. From this we can potentially look at changes in population numbers geographically, though important consideration must be given to the fact that this is recorded sightings and not necessarily a reflection of populations.*")
+
+# Binned points for a range of years, cached per dataset version and map settings.
+# The rows come from the year partitions, so this only touches the years being shown.
+@st.cache_data(max_entries=256, show_spinner=False)
+def map_points(version, start_year, end_year, mode, zoom, _df, _partitions):
+    df_filtered = year_range(_df, _partitions, start_year, end_year)
+    return binned_points(df_filtered['lat'], df_filtered['lon'], mode, zoom, MAX_POINTS_PER_MAP)
+
+
+# Draw the map for a range of years
+def draw_map(start_year, end_year, mode, zoom, height):
+    # Group sightings for the years into cells sized for the zoom level
+    with span("map_visual.bin") as record:
+        sightings_by_year, res = map_points(st.session_state.otter_version, start_year, end_year, mode, zoom, df, partitions)
+        record["rows"] = len(sightings_by_year)
+
+    if res is None:
+        # Exact locations, scale the radius by the count as before
         sightings_by_year['radius'] = sightings_by_year['count'] * 700  # You can tweak this multiplier as needed
+    else:
+        # Keep each circle inside its cell, busier cells get bigger circles
+        max_count = max(sightings_by_year['count'].max(), 1) if len(sightings_by_year) else 1
+        half_cell_metres = res * 111_320 / 2
+        sightings_by_year['radius'] = half_cell_metres * np.sqrt(sightings_by_year['count'] / max_count).clip(0.3, 1)
+
+    # Create pydeck layer with adjusted radius
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=sightings_by_year,
+        get_position='[lon, lat]',
+        get_radius='radius',  # Use the normalized radius
+        get_color='[200, 30, 0, 160]',
+        pickable=True,
+    )
+
+    # Set the map view to center over the UK
+    view_state = pdk.ViewState(
+        latitude=54.0,
+        longitude=-2.0,
+        zoom=zoom,
+        pitch=0,
+    )
+
+    with span("map_visual.chart", rows=len(sightings_by_year)):
+        st.pydeck_chart(pdk.Deck(
+            map_style="mapbox://styles/mapbox/light-v9",
+            initial_view_state=view_state,
+            layers=[layer],
+            height=height,
+            tooltip={"text": "{count} sightings"},
+        ))
 
-        # Create pydeck layer with adjusted radius
-        layer = pdk.Layer(
-            "ScatterplotLayer",
-            data=sightings_by_year,
-            get_position='[lon, lat]',
-            get_radius='radius',  # Use the normalized radius
-            get_color='[200, 30, 0, 160]',
-            pickable=True,
-        )
-
-        # Set the map view to center over the UK
-        view_state = pdk.ViewState(
-            latitude=54.0,
-            longitude=-2.0,
-            zoom=5,
-            pitch=0,
-        )
-
-        # Render the map in the appropriate column of the grid
-        with cols[idx]:
-            st.write(f"Otter Sightings in {year}")
-            st.pydeck_chart(pdk.Deck(
-                map_style="mapbox://styles/mapbox/light-v9",
-                initial_view_state=view_state,
-                layers=[layer],
-                height=400,  # Set a fixed height for all maps
-            ))
+# Check for successful request
+if st.session_state.otter_located is not None:
+    # Cleaned data with valid locations, shared across pages (see cleaning.py)
+    df = st.session_state.otter_located
+
+    # Map settings - sightings are grouped into cells on the server so each map sends at most MAX_POINTS_PER_MAP points
+    setting_col1, setting_col2 = st.columns(2)
+    mode_labels = {'hex': 'Hexagons', 'grid': 'Grid squares', 'points': 'Exact locations'}
+    mode = setting_col1.selectbox("Group sightings by", BIN_MODES, format_func=mode_labels.get)
+    zoom = setting_col2.select_slider("Map zoom (higher zoom shows finer detail)", options=list(range(4, 10)), value=5)
+
+    # Rows for each year, worked out once per dataset version (the data is sorted by date)
+    partitions = get_year_partitions(st.session_state.otter_version, df)
+    first_year = partitions[0]
+    last_year = first_year + len(partitions[1]) - 2
+
+    if last_year < first_year:
+        st.info("There are no located sightings to map.")
+    else:
+        # Scrub through any year or range of years
+        start_year, end_year = st.slider("Years", min_value=first_year, max_value=max(last_year, first_year + 1),
+                                         value=(last_year, last_year))
+        label = f"{start_year}" if start_year == end_year else f"{start_year} to {end_year}"
+        st.write(f"{st.session_state.species_label} Sightings in {label}")
+        draw_map(start_year, end_year, mode, zoom, height=500)
+
+        # Four years across the last 15, e.g. 2009, 2014, 2019 and 2024
+        years = [last_year - 15, last_year - 10, last_year - 5, last_year]
+
+        # set up columns
+        cols = st.columns(4)
+
+        # loop through the years plotting a map for each one
+        for idx, year in enumerate(years):
+            # Render the map in the appropriate column of the grid
+            with cols[idx]:
+                st.write(f"{st.session_state.species_label} Sightings in {year}")
+                draw_map(year, year, mode, zoom, height=400)  # Set a fixed height for all maps
 
 else:
     st.error("Failed to load data.")
@@ -0,0 +1,157 @@
+# This file holds the NBN Atlas API client used to pull otter occurrences into the app
+
+# Import packages
+import json
+import os
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import span
+
+# Can be pointed elsewhere with OTTER_NBN_URL, e.g. at the stub API in benchmarks/stub_nbn.py
+NBN_SEARCH_URL = os.environ.get("OTTER_NBN_URL", "https://records-ws.nbnatlas.org/occurrences/search")
+
+# Defaults for paging through the API
+PAGE_SIZE = 5000
+MAX_RECORDS = 200000
+MAX_WORKERS = 4
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+TIMEOUT_SECONDS = 30
+
+# Status codes worth retrying, anything else is treated as a hard failure
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# API index fields (used in the `fl` parameter) and the names they come back under in each occurrence
+FIELD_NAMES = {
+    "id": "uuid",
+    "occurrence_date": "eventDate",
+    "latitude": "decimalLatitude",
+    "longitude": "decimalLongitude",
+}
+NUMERIC_FIELDS = {"occurrence_date", "latitude", "longitude"}
+
+# Only the fields the dashboard reads - pass as "fl" in the query params to switch on projected ingestion
+DASHBOARD_FL = ",".join(FIELD_NAMES)
+
+
+# Session with a connection pool big enough for every worker thread
+def make_session(max_workers=MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Fetch a single page, retrying connection errors and 5xx/429 responses with exponential backoff
+def fetch_page(session, url, params, start_index, page_size,
+               retries=RETRIES, backoff=BACKOFF_SECONDS, timeout=TIMEOUT_SECONDS, parse=json.loads):
+    page_params = dict(params, startIndex=start_index, pageSize=page_size)
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, params=page_params, timeout=timeout)
+            if response.status_code not in RETRY_STATUS:
+                response.raise_for_status()
+                with span("api.parse_page", rows=page_size):
+                    return parse(response.content)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        if attempt < retries:
+            time.sleep(backoff * (2 ** attempt))
+    response.raise_for_status()
+
+
+# Parse a page keeping only the requested fields.
+# Each occurrence is picked apart as soon as the decoder builds it and its values are appended to typed
+# column arrays, so the page's full list of dicts is never held in memory.
+def parse_projected(content, fl):
+    index_fields = fl.split(",")
+    # Accept either the index name or the occurrence name for each field
+    lookup = {}
+    for field in index_fields:
+        lookup[field] = field
+        lookup[FIELD_NAMES.get(field, field)] = field
+    columns = {field: array("d") if field in NUMERIC_FIELDS else [] for field in index_fields}
+
+    def collect(pairs):
+        found = {lookup[key]: value for key, value in pairs if key in lookup}
+        if not found:
+            return dict(pairs)
+        for field, values in columns.items():
+            value = found.get(field)
+            if field in NUMERIC_FIELDS:
+                values.append(value if isinstance(value, (int, float)) else np.nan)
+            else:
+                values.append(value)
+        return None
+
+    page = json.loads(content, object_pairs_hook=collect)
+    page["occurrences"] = pd.DataFrame({
+        FIELD_NAMES.get(field, field): np.frombuffer(values, dtype="float64") if field in NUMERIC_FIELDS else values
+        for field, values in columns.items()
+    })
+    return page
+
+
+# Flatten one page of occurrences into a data frame
+def page_to_frame(page):
+    occurrences = page.get("occurrences")
+    if isinstance(occurrences, pd.DataFrame):
+        return occurrences if not occurrences.empty else None
+    if not occurrences:
+        return None
+    return pd.json_normalize(occurrences, errors='ignore')
+
+
+# Pull every page of a query concurrently and stitch the pages together in order.
+# The first page tells us how many records there are, the rest are fetched by a bounded pool
+# and flattened as soon as they arrive so only a handful of raw JSON pages are held at once.
+# If the params include "fl", only those fields are requested and parsed (see parse_projected).
+def fetch_occurrences(params, url=None, page_size=PAGE_SIZE, max_records=MAX_RECORDS,
+                      max_workers=MAX_WORKERS, session=None, retries=RETRIES, backoff=BACKOFF_SECONDS):
+    url = url or NBN_SEARCH_URL
+    parse = json.loads
+    if params.get("fl"):
+        # Facets aren't used by the dashboard either, so skip them
+        params = dict(params, facet="false")
+        parse = partial(parse_projected, fl=params["fl"])
+
+    with span("api.fetch") as record:
+        own_session = session is None
+        if own_session:
+            session = make_session(max_workers)
+
+        try:
+            first = fetch_page(session, url, params, 0, page_size, retries, backoff, parse=parse)
+            total = min(first.get("totalRecords") or 0, max_records)
+            frames = {0: page_to_frame(first)}
+            del first
+
+            starts = range(page_size, total, page_size)
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(fetch_page, session, url, params, start,
+                                min(page_size, total - start), retries, backoff, parse=parse): start
+                    for start in starts
+                }
+                for future in as_completed(futures):
+                    frames[futures[future]] = page_to_frame(future.result())
+        finally:
+            if own_session:
+                session.close()
+
+        pages = [frames[start] for start in sorted(frames) if frames[start] is not None]
+        if not pages:
+            return None
+        df = pd.concat(pages, ignore_index=True)
+        record["rows"] = len(df)
+        return df
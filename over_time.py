@@ -1,23 +1,14 @@
 # Import packages
 
 import streamlit as st
-import pandas as pd
-import requests
-import matplotlib.pyplot as plt
-import folium
-from folium.plugins import MarkerCluster
-from PIL import Image
-from io import BytesIO
-import altair as alt
-import numpy as np
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 import pydeck as pdk
+from io import BytesIO
+from matplotlib.figure import Figure
+from aggregates import yearly_counts
+from instrumentation import span
+from trends import TREND_YEARS, area_trends
 
 
-# Set page layout
-st.set_page_config(layout="wide")
-
 # Add Mammal Society logo to sidebar
 # st.sidebar.markdown("""
 #     <div style="text-align: center;">
@@ -26,41 +17,118 @@ st.set_page_config(layout="wide")
 # """, unsafe_allow_html=True)
 
 # Add title and page explanation
-st.write("### Otter Sightings Over Time (Time Series)")
-st.markdown("*This graph shows a record of otter sightings over time from the earliest date in the data set. From this we can potentially look at changes in otter population numbers, though important consideration must be given to the fact that this is recorded otter sightings and not necessarily a reflection of otter populations.*")
+st.write(f"### {st.session_state.species_label} Sightings Over Time (Time Series)")
+st.markdown("*This graph shows a record of sightings over time from the earliest date in the data set, with a line for each species shown. From this we can potentially look at changes in population numbers, though important consideration must be given to the fact that this is recorded sightings and not necessarily a reflection of populations.*")
+
+
+# Access the pre-aggregated sightings from session state from app.py
+if st.session_state.otter_cube is not None:
+    cube = st.session_state.otter_cube
+
+else:
+    st.error("Failed to load data.")
+    st.stop()
+
 
+# Draw the yearly time series as PNG bytes, cached per dataset version.
+# The figure is built without pyplot so it isn't kept in pyplot's global figure registry,
+# and it's released as soon as the image has been saved.
+@st.cache_data(max_entries=4, show_spinner=False)
+def yearly_chart_png(version, _cube):
+    # Sightings by year, a column per species
+    sightings_by_year = yearly_counts(_cube, by_species=True)
 
-# Access the loaded data from session state from app.py
-df = st.session_state.get('otter_data')
+    # Plot the time series
+    fig = Figure(figsize=(16, 6))
+    ax = fig.subplots()
 
-# Group data by year
-sightings_by_year = df.groupby('year').size()
+    # Plot the sightings by year - dark grey for a single species, a colour each when there are several
+    for species in sightings_by_year.columns:
+        color = '#333333' if len(sightings_by_year.columns) == 1 else None
+        ax.plot(sightings_by_year.index, sightings_by_year[species].values, marker='o', linestyle='-', linewidth=2, markersize=6, color=color, label=species)
+    if len(sightings_by_year.columns) > 1:
+        ax.legend(frameon=False)
 
-# Plot the time series
-fig, ax = plt.subplots(figsize=(16, 6))  
+    # Customize plot to match minimalist and professional vibe
+    ax.set_xlabel('Year', fontsize=12, color='#333333')  # Dark grey labels
+    ax.set_ylabel('Number of Sightings', fontsize=12, color='#333333')  # Dark grey labels
 
-# Plot the sightings by year
-sightings_by_year.plot(kind='line', ax=ax, marker='o', linestyle='-', linewidth=2, markersize=6, color='#333333')
+    # Remove gridlines for a cleaner look
+    ax.grid(False)
 
-# Customize plot to match minimalist and professional vibe
-ax.set_xlabel('Year', fontsize=12, color='#333333')  # Dark grey labels
-ax.set_ylabel('Number of Sightings', fontsize=12, color='#333333')  # Dark grey labels
+    # Set background color to match page background
+    fig.patch.set_facecolor('#F7F7F7')  
+    ax.set_facecolor('#F7F7F7')  
 
-# Remove gridlines for a cleaner look
-ax.grid(False)
+    # Remove the top and right borders for a cleaner look
+    ax.spines['top'].set_visible(False)
+    ax.spines['right'].set_visible(False)
+    ax.spines['left'].set_linewidth(0.5)  # Thin left border
+    ax.spines['bottom'].set_linewidth(0.5)  # Thin bottom border
 
-# Set background color to match page background
-fig.patch.set_facecolor('#F7F7F7')  
-ax.set_facecolor('#F7F7F7')  
+    # Render to PNG and free the figure
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', facecolor=fig.get_facecolor(), bbox_inches='tight')
+    fig.clear()
+    return buffer.getvalue()
 
-# Remove the top and right borders for a cleaner look
-ax.spines['top'].set_visible(False)
-ax.spines['right'].set_visible(False)
-ax.spines['left'].set_linewidth(0.5)  # Thin left border
-ax.spines['bottom'].set_linewidth(0.5)  # Thin bottom border
 
 # Display the plot 
-st.pyplot(fig)
+with span("over_time.chart"):
+    st.image(yearly_chart_png(st.session_state.otter_version, cube), use_container_width=True)
+
+# Trend in every area for one species, fitted in one go and cached per dataset version (see trends.py)
+@st.cache_data(max_entries=16, show_spinner=False)
+def trends_by_area(version, species, _cube):
+    return area_trends(_cube, species)
+
+st.write(f"### Rising and Declining Areas (Last {TREND_YEARS} Years)")
+st.markdown("*Each area's sightings are compared with the national total each year, so a general rise in recording doesn't show up as a rise everywhere. Areas marked as declining make up a shrinking share of sightings, which could mean fewer animals there or less recording there - it's a prompt to look closer rather than proof of decline.*")
+
+# Trends are worked out for one species at a time, so pick one when several are shown
+species = st.session_state.otter_species
+trend_species = st.selectbox("Species", species) if len(species) > 1 else species[0]
+
+with span("over_time.trends") as record:
+    trends = trends_by_area(st.session_state.otter_version, trend_species, cube)
+    record["rows"] = len(trends)
+
+if trends.empty:
+    st.info("There aren't enough located sightings to work out trends by area.")
+else:
+    # Map of every area, red for declining, green for rising and grey otherwise
+    trend_colours = {'Declining': [200, 30, 0, 180], 'Rising': [30, 140, 60, 180], 'No clear trend': [150, 150, 150, 90]}
+    areas = trends.assign(colour=trends['Trend'].map(trend_colours), change=trends['Change per year'].round(1))
+    layer = pdk.Layer(
+        "ScatterplotLayer",
+        data=areas,
+        get_position='[lon, lat]',
+        get_radius=15000,
+        get_fill_color='colour',
+        pickable=True,
+    )
+    view_state = pdk.ViewState(latitude=54.0, longitude=-2.0, zoom=4.5, pitch=0)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.pydeck_chart(pdk.Deck(
+            map_style="mapbox://styles/mapbox/light-v9",
+            initial_view_state=view_state,
+            layers=[layer],
+            height=500,
+            tooltip={"text": "{Trend}: {change}% a year ({Sightings} sightings)"},
+        ))
+
+    # Strongest trends each way
+    with col2:
+        columns = ['lat', 'lon', 'Sightings', 'Change per year']
+        formats = {'lat': '{:.2f}', 'lon': '{:.2f}', 'Change per year': '{:+.1f}%'}
+        st.write("**Declining areas**")
+        declining = trends[trends['Trend'] == 'Declining'].head(10)[columns]
+        st.dataframe(declining.style.format(formats), hide_index=True, use_container_width=True)
+        st.write("**Rising areas**")
+        rising = trends[trends['Trend'] == 'Rising'].iloc[::-1].head(10)[columns]
+        st.dataframe(rising.style.format(formats), hide_index=True, use_container_width=True)
 
 # Note to provide information about where the data is coming from
 st.markdown("*Showing live data from National Biodiversity Network Trust Atlas API.*")
@@ -0,0 +1,104 @@
+# This file reports how long each page's imports take to load in a fresh interpreter, using python -X importtime
+#
+# Usage: python profile_imports.py [--repeat 3] [--top 5] [--budget-ms 1000]
+#
+# For each page it shows the cold import time on its own, the extra time on top of app.py's imports
+# (what a user pays on first visiting the page) and the slowest top-level imports.
+# With --budget-ms it exits with an error if any page's extra time goes over the budget.
+
+# Import packages
+import argparse
+import ast
+import os
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+APP = "app.py"
+
+MARKER = "--page-imports--"
+
+
+# Page scripts registered with st.Page(...) in app.py, in navigation order
+def app_pages(path=APP):
+    with open(os.path.join(APP_DIR, path)) as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [node.args[0].value for node in ast.walk(tree)
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "Page"
+            and node.args and isinstance(node.args[0], ast.Constant)]
+
+
+# Top-level import statements of a script, as source code
+def page_imports(path):
+    with open(os.path.join(APP_DIR, path)) as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+# Run the imports under -X importtime and return {module: cumulative microseconds} for the top-level
+# imports made before and after the marker line
+def importtime(before, after):
+    code = "\n".join(before + [f"import sys; sys.stderr.write({MARKER!r} + '\\n')"] + after)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=APP_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    sections = ({}, {})
+    section = 0
+    for line in result.stderr.splitlines():
+        if line.strip() == MARKER:
+            section = 1
+            continue
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under the module that pulled them in, only keep the top level
+        if not name.startswith("  "):
+            sections[section][name.strip()] = int(cumulative)
+    return sections
+
+
+# Best-of-N import profile for one page
+def profile_page(page, repeat=3):
+    app = page_imports(APP)
+    imports = page_imports(page)
+    best_alone, best_extra = None, None
+    for _ in range(repeat):
+        _, alone = importtime([], imports)
+        _, extra = importtime(app, imports)
+        if best_alone is None or sum(alone.values()) < sum(best_alone.values()):
+            best_alone = alone
+        if best_extra is None or sum(extra.values()) < sum(best_extra.values()):
+            best_extra = extra
+    return best_alone, best_extra
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the cold import time of each page.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per page, the fastest is reported")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports to list per page")
+    parser.add_argument("--budget-ms", type=float, help="fail if a page adds more than this on top of app.py")
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    print(f"{'page':<22}{'cold (ms)':>12}{'extra (ms)':>12}  slowest imports (cold, ms)")
+    for page in [APP] + app_pages():
+        alone, extra = profile_page(page, args.repeat)
+        cold_ms = sum(alone.values()) / 1000
+        extra_ms = sum(extra.values()) / 1000 if page != APP else cold_ms
+        slowest = sorted(alone.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        print(f"{page:<22}{cold_ms:>12.0f}{extra_ms:>12.0f}  "
+              + ", ".join(f"{name} {us / 1000:.0f}" for name, us in slowest))
+        if args.budget_ms is not None and page != APP and extra_ms > args.budget_ms:
+            over_budget.append(page)
+
+    if over_budget:
+        print(f"Over the {args.budget_ms:.0f}ms budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
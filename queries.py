@@ -0,0 +1,54 @@
+# This file builds NBN Atlas queries for one or more species and runs them concurrently through the shared cache
+
+# Import packages
+from concurrent.futures import ThreadPoolExecutor
+
+from data_cache import cache_key, get_snapshot
+from nbn_api import DASHBOARD_FL
+
+# Species the dashboard can show, by common name (UK mustelids)
+SPECIES = {
+    "Otter": "Lutra lutra",
+    "Pine Marten": "Martes martes",
+    "Polecat": "Mustela putorius",
+    "Stoat": "Mustela erminea",
+    "Weasel": "Mustela nivalis",
+    "Badger": "Meles meles",
+    "American Mink": "Neovison vison",
+}
+
+# Species shown when none are picked
+DEFAULT_SPECIES = "Otter"
+
+# Most species fetched at the same time
+MAX_PARALLEL_QUERIES = 4
+
+
+# Params for every record of a taxon, only the fields the dashboard uses.
+# Date ranges and areas are cut from this one cached pull on the cleaned data (see cleaning.time_window
+# and export.iter_chunks), so every view of a taxon shares a single download.
+def taxon_params(taxon):
+    return {"q": f'taxon_name:"{taxon}"', "fl": DASHBOARD_FL}
+
+
+# Species names for titles, e.g. "Otter", "Otter and Badger" or "Otter, Stoat and Badger"
+def species_label(names):
+    names = list(names)
+    if len(names) <= 1:
+        return "".join(names)
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+# Fetch several queries at once. Identical queries (same params) are only fetched once, and the
+# shared cache makes concurrent sessions asking for the same query wait on a single download.
+# Returns a (data, dataset version) pair for each query, in order.
+def load_snapshots(params_list, max_workers=MAX_PARALLEL_QUERIES, **snapshot_kwargs):
+    unique = {}
+    for params in params_list:
+        unique.setdefault(cache_key(params), params)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique)))) as pool:
+        futures = {key: pool.submit(get_snapshot, params, **snapshot_kwargs) for key, params in unique.items()}
+        results = {key: future.result() for key, future in futures.items()}
+    return [results[cache_key(params)] for params in params_list]
+
@@ -1,18 +1,16 @@
 import streamlit as st
 import pandas as pd
-import requests
-import matplotlib.pyplot as plt
-import folium
-from folium.plugins import MarkerCluster
 import altair as alt
-import numpy as np
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-from datetime import datetime, timedelta
+from cleaning import last_years, time_window
+from geocode_cache import get_locality_cache
+from hotspots import find_hotspots
+from instrumentation import span
 
+# Seconds between redraws of the hotspot chart while locality names are being looked up
+LOCALITY_REFRESH_SECONDS = 2
 
-# Set up page and add Mammal Soceity to sidebar
-st.set_page_config(layout="wide")
+
+# Add Mammal Soceity to sidebar
 # st.sidebar.markdown("""
 #     <div style="text-align: center;">
 #         <img src="https://images.squarespace-cdn.com/content/v1/654a3265fcbd755384b0552f/5cc2d0e2-dd55-449f-ae3a-949ab6871318/MSlogo_colour_strapblue_L-800px.jpeg?format=1500w" alt="Logo" width="100"/>
@@ -21,40 +19,22 @@ st.set_page_config(layout="wide")
 
 # Add title and page description
 st.write("### Insights & Recommendations")
-st.markdown("*This page provides an overview of statistics related to otter sightings.*")
-st.markdown("*Summary statistics are provided alongside geographical locations showing top locations for otter sightings, potentially reflective of changes to otter populations. Finally some data quality observations are made for clarity as well as potential recommendations for future work. Important consideration must be given to the fact that this is recorded otter sightings and not necessarily a reflection of otter populations.*")
-
-# get session state data
-df = st.session_state.otter_data
-
-# Order returned data frame by date
-df_sorted = df.sort_values(by='eventDate', ascending=True)
-
-# Lots of blank rows! Let's remove those with no date
-df = df_sorted.dropna(subset=['eventDate'])
-
-# There are some wierd date inputs, lets force these to numeric values
-df['date'] = pd.to_datetime(df['eventDate'], unit='ms', errors='coerce')
-
-# Rename lat and lon columns to allow mapping etc
-df['lat'] = df['decimalLatitude']
-df['lon'] = df['decimalLongitude']
+st.markdown(f"*This page provides an overview of statistics related to {st.session_state.species_label} sightings.*")
+st.markdown("*Summary statistics are provided alongside geographical locations showing top locations for sightings, potentially reflective of changes to populations. Finally some data quality observations are made for clarity as well as potential recommendations for future work. Important consideration must be given to the fact that this is recorded sightings and not necessarily a reflection of populations.*")
 
-# Identifies invalid lat and lon values
-invalid_lat_lon = df[(df['lat'].abs() > 90) | (df['lon'].abs() > 180) | 
-                (~np.isfinite(df['lat'])) | (~np.isfinite(df['lon']))]
+# get cleaned session state data - dates parsed, invalid lat/lon and missing dates removed (see cleaning.py)
+if st.session_state.otter_located is not None:
+    df = st.session_state.otter_located
 
-# Again, force errors to resolve
-df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
-df['lon'] = pd.to_numeric(df['lon'], errors='coerce')
+else:
+    st.error("Failed to load data.")
+    st.stop()
 
-# Drop null lat/lon values
-df = df.dropna(subset=['lat', 'lon'])
-
-# Summarise otter sighting data
+# Summarise sighting data
 st.write("### Summary Statistics")
-total_sightings = df.shape[0]
-unique_days = df['date'].nunique()
+with span("recommendations.summary", rows=len(df)):
+    total_sightings = df.shape[0]
+    unique_days = df['date'].nunique()
 sightings_per_day = total_sightings / unique_days if unique_days > 0 else 0
 total_days = (pd.Timestamp.today() - df['date'].min()).days
 sightings_per_total_days = total_sightings/total_days
@@ -66,53 +46,56 @@ col2.markdown(f"*Unique Observation Days:* {unique_days}")
 col3.markdown(f"*Avg Sightings Per Observation Day:* {sightings_per_day:.2f}")
 col4.markdown(f"*Avg Sighting Per Total Days:* {sightings_per_total_days:.2f}")
 
-# Step 1: Filter sightings for the last 10 years - filter last ten years from data frame
-today = datetime.today()
-ten_years_ago = today - timedelta(days=365 * 10)
-df['date'] = pd.to_datetime(df['date'])  # Ensure 'date' column is in datetime format
-df_recent = df[df['date'] >= ten_years_ago]
-
-# Step 2: Find top 5 lat/lon hotspots (using the filtered data)
-top_coords = (
-    df_recent.groupby(['lat', 'lon'])
-    .size()
-    .reset_index(name='Sightings')
-    .sort_values(by='Sightings', ascending=False)
-    .head(5)  # Only top 5
-)
+# Top hotspots since a date, cached per dataset version
+@st.cache_data(max_entries=8, show_spinner=False)
+def recent_hotspots(version, since, _df):
+    df_recent = time_window(_df, start=since)
+    return find_hotspots(df_recent['lat'], df_recent['lon'], top_n=5)
+
+# Step 1: Filter sightings for the last 10 years - a date-sorted slice of the data frame
+ten_years_ago, _ = last_years(10)
+
+# Step 2: Find top 5 hotspots (using the filtered data) - nearby sightings are clustered together
+# rather than grouped on exact lat/lon, see hotspots.py
+with span("recommendations.hotspots", rows=len(df)):
+    top_coords = recent_hotspots(st.session_state.otter_version, ten_years_ago, df)
 
 # Step 3: Reverse geocode after selecting top 5 to get nearby area/town etc
-geolocator = Nominatim(user_agent="hotspot-locality-mapper")
-reverse = RateLimiter(geolocator.reverse, min_delay_seconds=1)
-
-def get_locality(lat, lon):
-    try:
-        location = reverse((lat, lon), exactly_one=True, language='en')
-        if location:
-            for key in ['city', 'town', 'village', 'hamlet']:
-                if key in location.raw['address']:
-                    return location.raw['address'][key]
-        return "Unknown"
-    except:
-        return "Unknown"
-
-# Apply reverse geocoding to get area/town etc
-top_coords['Locality'] = top_coords.apply(lambda row: get_locality(row['lat'], row['lon']), axis=1)
-
-
-# Step 6: Show results by locality 
-top_hotspots = (
-    top_coords.groupby('Locality')['Sightings']
-    .sum()
-    .reset_index()
-    .sort_values(by='Sightings', ascending=False)
-)
+# Names come from a persistent cache, any not looked up yet are fetched in the background
+locality_cache = get_locality_cache()
+
+
+# Locality names for the hotspots, showing coordinates until the name arrives.
+# Also says whether any names are still being looked up.
+def hotspot_localities():
+    with span("recommendations.geocode", rows=len(top_coords)):
+        localities = locality_cache.lookup(zip(top_coords['lat'], top_coords['lon']))
+    names = [
+        locality if locality is not None else f"{lat:.3f}, {lon:.3f}"
+        for locality, lat, lon in zip(localities, top_coords['lat'], top_coords['lon'])
+    ]
+    return names, any(locality is None for locality in localities) and locality_cache.busy()
+
+
+_, localities_pending = hotspot_localities()
 
 col1, col2 = st.columns(2)
 textColor = "#333333"  # From your TOML
 
-with col1:
-    st.write("### Top Otter Sightings Locations (Last 10 Years)")
+
+# Step 4: Show results by locality
+# While names are still being looked up the chart redraws itself every few seconds to fill them in
+@st.fragment(run_every=LOCALITY_REFRESH_SECONDS if localities_pending else None)
+def top_locations():
+    names, pending = hotspot_localities()
+    top_hotspots = (
+        top_coords.assign(Locality=names).groupby('Locality')['Sightings']
+        .sum()
+        .reset_index()
+        .sort_values(by='Sightings', ascending=False)
+    )
+
+    st.write(f"### Top {st.session_state.species_label} Sightings Locations (Last 10 Years)")
 
     # Filter out unknown localities
     top_hotspots = top_hotspots[top_hotspots['Locality'] != 'Unknown']
@@ -131,7 +114,18 @@ with col1:
         height=300
     )
 
-    st.altair_chart(chart, use_container_width=True)
+    with span("recommendations.chart"):
+        st.altair_chart(chart, use_container_width=True)
+
+    if pending:
+        st.caption("*Some locality names are still being looked up and are shown as coordinates for now.*")
+    elif localities_pending:
+        # Every name is in, rerun the page once so the chart stops redrawing
+        st.rerun()
+
+
+with col1:
+    top_locations()
 
 
 # Add recommendations
@@ -151,7 +145,7 @@ with col2:
 col1, col2 = st.columns(2)
 with col1:
     st.write("**Data Information**")
-    st.markdown('*Data has been cleaned to remove invalid lat/lon values as well as those records missing a date. Data collection has also been limited to 100,000 rows to faciliate app performance. The data is accessed through a live connection to the National Biodiversity Network API. The data is refreshed each time the app is refreshed.*')
+    st.markdown('*Data has been cleaned to remove invalid lat/lon values as well as those records missing a date. Data collection has also been limited to 100,000 rows to faciliate app performance. The data is accessed through a live connection to the National Biodiversity Network API. The data is cached and refreshed from the API in the background every hour.*')
 
 # Add contact and project information
 with col2:
@@ -1,13 +1,13 @@
 # import packages
 
 import streamlit as st
-import pandas as pd
-import requests
 import altair as alt
-import matplotlib.pyplot as plt
+import pandas as pd
+from aggregates import species_month_season_counts
+from cleaning import last_years, time_window
+from instrumentation import span
 
-# set page layout and add Mammal Society logo to sidebar
-st.set_page_config(layout="wide")
+# add Mammal Society logo to sidebar
 # st.sidebar.markdown("""<div style="text-align: center;">
 #         <img src="https://images.squarespace-cdn.com/content/v1/654a3265fcbd755384b0552f/5cc2d0e2-dd55-449f-ae3a-949ab6871318/MSlogo_colour_strapblue_L-800px.jpeg?format=1500w" alt="Logo" width="100"/>
 #     </div>
@@ -16,53 +16,40 @@ st.set_page_config(layout="wide")
 # add page title
 st.write("### Seasonal Changes")
 
-# get data from session state
-if st.session_state.otter_data is not None:
-    df = st.session_state.otter_data
-
-    # Clean the data - change datetime to recognizable format
-    df['eventDate'] = pd.to_datetime(df['eventDate'], unit='ms')
-
-    # Order by date
-    df_sorted = df.sort_values(by='eventDate', ascending=True)
-
-    # Remove blank rows
-    df = df_sorted.dropna(subset=['eventDate'])
+# get cleaned data from session state (sorted by date, see cleaning.py)
+if st.session_state.otter_clean is not None:
+    df = st.session_state.otter_clean
 
 else:
     st.error("Failed to load data.")
-
-# Step 1: Extract month from the date column
-df_recent = df
-df_recent['month'] = df_recent['eventDate'].dt.month
-
-# Season function
-def get_season(month):
-    if month in [12, 1, 2]:
-        return 'Winter'
-    elif month in [3, 4, 5]:
-        return 'Spring'
-    elif month in [6, 7, 8]:
-        return 'Summer'
-    else:
-        return 'Autumn'
-
-df_recent['season'] = df_recent['month'].apply(get_season)
-
-# Step 2: Group by month or season and count sightings
-seasonal_sightings = (
-    df_recent.groupby(['season'])
-    .size()
-    .reset_index(name='sightings')
-    .sort_values(by='sightings', ascending=False)
-)
-
-monthly_sightings = (
-    df_recent.groupby(['month'])
-    .size()
-    .reset_index(name='sightings')
-    .sort_values(by='month')
-)
+    st.stop()
+
+# Monthly (12 bins) and seasonal (4 bins) sightings of each species for a date range, cached per dataset version and range
+@st.cache_data(max_entries=32, show_spinner=False)
+def month_and_season_sightings(version, start, end, _df):
+    df_recent = time_window(_df, start, end)
+    return species_month_season_counts(df_recent['month'], df_recent['species'])
+
+# Step 1: Choose the date range - the last 10 years by default
+first_date = df['date'].iloc[0].date()
+last_date = df['date'].iloc[-1].date()
+default_start = min(max(last_years(10)[0].date(), first_date), last_date)
+date_range = st.date_input("Date range", value=(default_start, last_date), min_value=first_date, max_value=last_date)
+
+# While only the first date of the range has been picked, use it up to the latest sighting
+start_date = date_range[0]
+end_date = date_range[1] if len(date_range) > 1 else last_date
+
+# Step 2: Count sightings by month and season within the range (a date-sorted slice, see cleaning.py)
+# Seasons come from a month lookup table, see aggregates.py
+with span("seasonal.aggregate"):
+    monthly_sightings, seasonal_sightings = month_and_season_sightings(
+        st.session_state.otter_version, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1), df)
+seasonal_sightings = seasonal_sightings.sort_values(by='sightings', ascending=False)
+
+# With several species, bars for each species sit side by side in their own colour
+several_species = monthly_sightings['species'].nunique() > 1
+species_color = alt.Color('species:N', title='Species')
 
 # Step 3: Visualize seasonal trends (using bar chart for season or month)
 # Define a color palette with vibrant and subtle shades
@@ -74,25 +61,31 @@ seasonal_chart = alt.Chart(seasonal_sightings).mark_bar().encode(
     x=alt.X('season:N', sort=['Spring', 'Summer', 'Autumn', 'Winter']),
     y='sightings:Q',
     color=alt.Color('season:N', scale=color_palette),  # Apply the new color palette
-    tooltip=['season:N', 'sightings:Q']
+    tooltip=['species:N', 'season:N', 'sightings:Q']
 )
+if several_species:
+    seasonal_chart = seasonal_chart.encode(color=species_color, xOffset='species:N')
 
 # Bar chart for monthly sightings
 monthly_chart = alt.Chart(monthly_sightings).mark_bar().encode(
     x='month:O',
     y='sightings:Q',
     color=alt.Color('month:O', scale=alt.Scale(range=['#B0E0E6', '#98FB98', '#F0E68C', '#D2B48C', '#B0E0E6', '#98FB98', '#F0E68C', '#D2B48C', '#B0E0E6', '#98FB98', '#F0E68C', '#D2B48C'])),  # Same colors as seasonal
-    tooltip=['month:O', 'sightings:Q']
+    tooltip=['species:N', 'month:O', 'sightings:Q']
 )
+if several_species:
+    monthly_chart = monthly_chart.encode(color=species_color, xOffset='species:N')
 
 # Display charts
 
-st.markdown("*This graph shows seasonal changes in otter sightings over the last 10 years.*")
-st.altair_chart(seasonal_chart, use_container_width=True)
+st.markdown(f"*This graph shows seasonal changes in {st.session_state.species_label} sightings from {start_date:%d %B %Y} to {end_date:%d %B %Y}.*")
+with span("seasonal.chart"):
+    st.altair_chart(seasonal_chart, use_container_width=True)
 
 
-st.markdown("*This graph shows monthly changes in otter sightings over the last 10 years.*")
-st.altair_chart(monthly_chart, use_container_width=True)
+st.markdown(f"*This graph shows monthly changes in {st.session_state.species_label} sightings from {start_date:%d %B %Y} to {end_date:%d %B %Y}.*")
+with span("seasonal.chart"):
+    st.altair_chart(monthly_chart, use_container_width=True)
 
 # Note to provide information about where the data is coming from
 st.markdown("*Showing live data from National Biodiversity Network Trust Atlas API.*")
@@ -0,0 +1,124 @@
+# This file publishes derived data frames as read-only Arrow IPC files that every Streamlit process memory-maps
+#
+# Each frame is written once per dataset version. Whichever process builds it first writes it atomically,
+# and every other process (and every later rerun) maps the same file. Columns are handed to pandas without
+# copying, so the operating system keeps a single copy of the data in its page cache however many worker
+# processes and sessions read it. Mapped columns are read-only, which the app relies on anyway (copy-on-write).
+
+# Import packages
+import glob
+import hashlib
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+from data_cache import CACHE_DIR, parse_version
+from instrumentation import span
+
+# Publishing a frame deletes the older versions of it straight away. Any other snapshot untouched for this
+# long (e.g. of a species nobody has picked since) is deleted then too.
+SNAPSHOT_MAX_AGE_SECONDS = 24 * 60 * 60
+
+# Bump when the columns of the shared frames change, so snapshots written by older code aren't mapped
+SNAPSHOT_FORMAT = 2
+
+
+# File for a named frame at a dataset version, "<name>-<queries>-<update times>-<version>.arrow".
+# Every version of the same queries shares the middle part, and the update times (one per query, see
+# data_cache.parse_version) tell which one is newer. Combined versions can be long, so they're hashed.
+def snapshot_path(name, version, cache_dir=CACHE_DIR):
+    parts = [parse_version(part) for part in version.split("+")]
+    queries = hashlib.sha1("+".join(key for key, _, _ in parts).encode()).hexdigest()[:8]
+    updated = ".".join(str(updated_at) for _, _, updated_at in parts)
+    digest = hashlib.sha1(f"{SNAPSHOT_FORMAT}:{version}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "frames", f"{name}-{queries}-{updated}-{digest}.arrow")
+
+
+# Arrow table holding the columns exactly as they are in pandas. NaN stays NaN rather than becoming null,
+# and there's a single chunk, so reading it back into pandas copies nothing.
+# Categoricals are stored as their codes plus a dictionary of the categories.
+def _to_table(df):
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = values.cat.codes.to_numpy()
+            columns[col] = pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0),
+                                                          pa.array(values.cat.categories.to_numpy()),
+                                                          ordered=values.cat.ordered)
+        else:
+            columns[col] = pa.array(values.to_numpy(), from_pandas=False)
+    return pa.table(columns)
+
+
+# Write atomically so other processes never map a half-written file
+def publish_frame(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    table = _to_table(df)
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=max(len(df), 1))
+    os.replace(tmp, path)
+    _remove_old_snapshots(path)
+
+
+# Data frame backed by the memory-mapped file, without copying any column.
+# Arrow can't hand categoricals over without copying, so they're rebuilt from the mapped codes.
+def map_frame(path):
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    categorical = [i for i, field in enumerate(table.schema) if pa.types.is_dictionary(field.type)]
+    df = table.drop_columns([table.column_names[i] for i in categorical]).to_pandas(split_blocks=True, zero_copy_only=True)
+    for i in categorical:
+        column = table.column(i)
+        values = column.chunk(0) if column.num_chunks == 1 else column.combine_chunks()
+        codes = values.indices.to_numpy(zero_copy_only=True)
+        df.insert(i, table.column_names[i], pd.Categorical.from_codes(
+            codes, categories=values.dictionary.to_pandas(), ordered=values.type.ordered))
+    return df
+
+
+# Frame `name` at `version`, mapped from the shared snapshot. If no process has published it yet,
+# build() makes it and it's published for everyone else.
+def shared_frame(name, version, build, cache_dir=CACHE_DIR):
+    path = snapshot_path(name, version, cache_dir)
+    try:
+        return map_frame(path)
+    except (OSError, pa.ArrowException):
+        pass
+
+    df = build()
+    try:
+        with span(f"publish: {name}", rows=len(df)):
+            publish_frame(df, path)
+        return map_frame(path)
+    except (OSError, pa.ArrowException):
+        # Disk full, read-only cache directory or a type Arrow can't map without copying - use it in memory
+        return df
+
+
+# Update times in a snapshot file name
+def _updated_times(path):
+    return [int(t) for t in os.path.basename(path).split("-")[2].split(".")]
+
+
+# Delete the snapshots of the same frame and queries that `path` replaces - those with no newer data for any
+# query. A process still on an older version can publish it without deleting anything newer.
+# Snapshots of anything else are deleted once they're old. Processes still mapping one keep their mapping.
+def _remove_old_snapshots(path):
+    name, queries, _, _ = os.path.basename(path).split("-")
+    updated = _updated_times(path)
+    cutoff = time.time() - SNAPSHOT_MAX_AGE_SECONDS
+    for other in glob.glob(os.path.join(os.path.dirname(path), "*.arrow")):
+        if other == path:
+            continue
+        try:
+            if os.path.basename(other).startswith(f"{name}-{queries}-"):
+                if all(old <= new for old, new in zip(_updated_times(other), updated)):
+                    os.remove(other)
+            elif os.path.getmtime(other) < cutoff:
+                os.remove(other)
+        except (OSError, ValueError, IndexError):
+            pass
@@ -0,0 +1,100 @@
+# Tests for the sightings cube and the map binning
+
+# Import packages
+import numpy as np
+import pandas as pd
+import pytest
+
+import aggregates
+from aggregates import bin_points, binned_points, build_cube, combine_cubes, get_cube, refresh_cube
+from cleaning import clean_occurrences, combine_occurrences
+
+KEYS = ['year', 'month', 'lat_cell', 'lon_cell', 'species']
+
+
+def raw_occurrences(n, first, last, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(50, 53, n)
+    lat[::25] = np.nan
+    return pd.DataFrame({
+        'eventDate': np.sort(rng.integers(pd.Timestamp(first).value // 10 ** 6, pd.Timestamp(last).value // 10 ** 6, n)).astype('float64'),
+        'decimalLatitude': lat,
+        'decimalLongitude': rng.uniform(-3, 0, n),
+    })
+
+
+def sorted_cube(cube):
+    return cube.sort_values(KEYS).reset_index(drop=True)
+
+
+def test_cube_counts_every_sighting():
+    clean = clean_occurrences(raw_occurrences(5_000, "2000-01-01", "2024-12-31"))
+    cube = build_cube(clean)
+    assert cube['count'].sum() == len(clean)
+    assert not cube.duplicated(KEYS).any()
+    # Sightings without a location are counted in the no-location cell
+    assert cube.loc[cube['lat_cell'] == aggregates.NO_CELL, 'count'].sum() == clean['lat'].isna().sum()
+
+
+# Recounting only the newest months gives the same cube as counting everything again
+def test_refreshed_cube_matches_a_fresh_build():
+    old = raw_occurrences(4_000, "2000-01-01", "2024-06-15", seed=1)
+    new = raw_occurrences(500, "2024-06-15", "2024-12-31", seed=2)
+    cached = clean_occurrences(old)
+    clean = clean_occurrences(pd.concat([old, new], ignore_index=True))
+
+    refreshed = refresh_cube(build_cube(cached), clean, cached['date'].iloc[-1])
+    pd.testing.assert_frame_equal(sorted_cube(refreshed), sorted_cube(build_cube(clean)))
+
+
+def test_get_cube_refreshes_incrementally(monkeypatch):
+    monkeypatch.setattr(aggregates, "_cubes", {})
+    old = raw_occurrences(2_000, "2010-01-01", "2024-06-15", seed=3)
+    new = raw_occurrences(300, "2024-06-15", "2024-12-31", seed=4)
+    clean = clean_occurrences(pd.concat([old, new], ignore_index=True))
+
+    get_cube("k-100-100", clean_occurrences(old))
+    cube = get_cube("k-100-200", clean)
+    pd.testing.assert_frame_equal(sorted_cube(cube), sorted_cube(build_cube(clean)))
+    # The same version is served from memory
+    assert get_cube("k-100-200", clean) is cube
+
+
+def test_combined_cubes_match_a_cube_of_the_combined_sightings():
+    frames = [clean_occurrences(raw_occurrences(2_000, "2005-01-01", "2024-12-31", seed), species)
+              for seed, species in enumerate(["Otter", "Badger"])]
+    combined = combine_cubes([build_cube(frame) for frame in frames])
+    pd.testing.assert_frame_equal(sorted_cube(combined), sorted_cube(build_cube(combine_occurrences(frames))))
+
+
+@pytest.mark.parametrize("mode", ["hex", "grid", "points"])
+def test_binned_counts_add_up(mode):
+    rng = np.random.default_rng(5)
+    lat = np.round(rng.normal(52, 0.5, 10_000), 3)
+    lon = np.round(rng.normal(-1, 0.5, 10_000), 3)
+    points = bin_points(lat, lon, mode, res=0.1)
+    assert points['count'].sum() == len(lat)
+    assert not points.duplicated(['lat', 'lon']).any()
+
+
+# Every point lands in the hexagon whose centre is nearest to it
+def test_hex_bins_are_nearest_centres():
+    rng = np.random.default_rng(6)
+    lat = rng.uniform(51, 53, 2_000)
+    lon = rng.uniform(-2, 0, 2_000)
+    points = bin_points(lat, lon, 'hex', res=0.2)
+
+    scale = np.cos(np.radians(aggregates.UK_LAT))
+    distance = np.hypot((lon[:, None] - points['lon'].to_numpy()[None, :]) * scale,
+                        lat[:, None] - points['lat'].to_numpy()[None, :])
+    counts = np.bincount(distance.argmin(axis=1), minlength=len(points))
+    np.testing.assert_array_equal(counts, points['count'].to_numpy())
+
+
+def test_binned_points_fit_the_budget():
+    rng = np.random.default_rng(7)
+    lat = rng.uniform(50, 58, 50_000)
+    lon = rng.uniform(-6, 1, 50_000)
+    points, res = binned_points(lat, lon, 'hex', zoom=8, max_points=500)
+    assert len(points) <= 500 and res is not None
+    assert points['count'].sum() == len(lat)
@@ -0,0 +1,200 @@
+# Tests for the on-disk occurrences cache, with a fake in place of the NBN fetcher
+
+# Import packages
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+import data_cache
+from data_cache import (fetched_at, get_occurrences, get_snapshot, incremental_params, merge, parse_version,
+                        refresh_status, start_refresher)
+
+
+# Called like fetch_occurrences, answers with the frames it's given in turn and records its params.
+# An exception in the list is raised instead.
+class FakeFetch:
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def __call__(self, params):
+        self.calls.append(params)
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+def records(*rows):
+    return pd.DataFrame(rows, columns=['uuid', 'eventDate', 'decimalLatitude', 'decimalLongitude'])
+
+
+PARAMS = {"q": 'taxon_name:"Lutra lutra"', "fq": "data_resource_uid:dr1"}
+
+
+# Each test gets its own cache directory and an empty in-memory cache, with a clock it controls.
+# Background refreshers are only recorded, so nothing fetches behind a test's back.
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_cache, "_memory", {})
+    monkeypatch.setattr(data_cache, "_status", {})
+    monkeypatch.setattr(data_cache, "_refreshers", {})
+    monkeypatch.setattr(data_cache, "start_refresher", lambda params, **kwargs: data_cache._refreshers.setdefault(
+        data_cache.cache_key(params), kwargs))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(data_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_fresh_cache_is_served_without_fetching(cache_dir, clock):
+    fetch = FakeFetch(records(("a", 2.0, 51.0, -1.0), ("b", 1.0, 52.0, -2.0)))
+    df = get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    # Sorted by date
+    assert df['uuid'].tolist() == ["b", "a"]
+
+    clock[0] += 59
+    assert get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir) is df
+    # Another process starts from the copy on disk
+    data_cache._memory.clear()
+    assert get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)['uuid'].tolist() == ["b", "a"]
+    assert fetch.calls == [PARAMS]
+
+
+def test_incremental_params_keep_existing_filters():
+    since = pd.Timestamp("2024-03-05 10:30").value // 10 ** 6
+    fq = "occurrence_date:[2024-03-05T10:30:00Z TO *]"
+    assert incremental_params(PARAMS, since)["fq"] == ["data_resource_uid:dr1", fq]
+    assert incremental_params({"q": "x", "fq": ["a", "b"]}, since)["fq"] == ["a", "b", fq]
+    assert incremental_params({"q": "x"}, since) == {"q": "x", "fq": [fq]}
+
+
+# Once stale, only records from the newest cached date on are asked for, and merged in by uuid
+def test_stale_cache_is_refreshed_incrementally(cache_dir, clock):
+    newest = pd.Timestamp("2024-03-05").value // 10 ** 6
+    fetch = FakeFetch(
+        records(("a", 1.0, 51.0, -1.0), ("b", float(newest), 52.0, -2.0)),
+        records(("b", float(newest), 52.5, -2.5), ("c", float(newest + 1), 53.0, -3.0)),
+    )
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    clock[0] += 61
+    df = get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+
+    assert fetch.calls[1] == incremental_params(PARAMS, newest)
+    assert df['uuid'].tolist() == ["a", "b", "c"]
+    # The newer copy of "b" replaced the cached one
+    assert df.loc[df['uuid'] == "b", 'decimalLatitude'].item() == 52.5
+
+
+def test_full_refresh_replaces_the_cache(cache_dir, clock):
+    fetch = FakeFetch(records(("a", 1.0, 51.0, -1.0), ("b", 2.0, 52.0, -2.0)), records(("c", 3.0, 53.0, -3.0)))
+    get_occurrences(PARAMS, ttl=60, full_refresh=3600, fetch=fetch, cache_dir=cache_dir)
+    clock[0] += 3601
+    df = get_occurrences(PARAMS, ttl=60, full_refresh=3600, fetch=fetch, cache_dir=cache_dir)
+    assert fetch.calls == [PARAMS, PARAMS]
+    assert df['uuid'].tolist() == ["c"]
+
+
+def test_merge_keeps_the_newest_copy_of_each_record():
+    cached = records(("a", 1.0, 51.0, -1.0), ("b", 2.0, 52.0, -2.0))
+    df, changed = merge(cached, records(("a", 1.0, 51.5, -1.5), ("c", None, 53.0, -3.0), ("d", 1.5, 54.0, -4.0)))
+    assert changed
+    # Undated records are dropped, the rest sorted by date
+    assert df['uuid'].tolist() == ["a", "d", "b"]
+    assert df.loc[df['uuid'] == "a", 'decimalLatitude'].item() == 51.5
+
+
+def test_merge_without_new_records_is_unchanged():
+    cached = records(("a", 1.0, 51.0, -1.0), ("b", 2.0, 52.0, -2.0))
+    for new in [None, records(), records(("b", 2.0, 52.0, -2.0))]:
+        df, changed = merge(cached, new)
+        assert df is cached and not changed
+
+
+# A failed refresh serves the last good copy and records the error
+def test_failed_refresh_serves_the_stale_copy(cache_dir, clock):
+    fetch = FakeFetch(records(("a", 1.0, 51.0, -1.0)), requests.ConnectionError("API down"))
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    clock[0] += 61
+    df = get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert df['uuid'].tolist() == ["a"]
+    assert data_cache._status[data_cache.cache_key(PARAMS)]["error"] == "API down"
+
+
+def test_failed_first_fetch_returns_nothing(cache_dir, clock):
+    fetch = FakeFetch(requests.ConnectionError("API down"))
+    assert get_occurrences(PARAMS, fetch=fetch, cache_dir=cache_dir) is None
+
+
+# The version only changes when a refresh brings new or changed records, the fetch time always moves on
+def test_version_changes_only_with_the_data(cache_dir, clock):
+    fetch = FakeFetch(
+        records(("a", 1.0, 51.0, -1.0)),
+        records(("a", 1.0, 51.0, -1.0)),
+        None,
+        records(("b", 2.0, 52.0, -2.0)),
+    )
+    _, version = get_snapshot(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    for _ in range(2):
+        clock[0] += 61
+        get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+        assert get_snapshot(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)[1] == version
+        assert fetched_at(PARAMS, cache_dir) == clock[0]
+
+    clock[0] += 61
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    df, new_version = get_snapshot(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert df['uuid'].tolist() == ["a", "b"]
+    assert parse_version(new_version) == (data_cache.cache_key(PARAMS), int(clock[0]) - 183, int(clock[0]))
+
+
+# Only a cold start waits for the API, after that the cached snapshot is served even when it's stale
+def test_snapshot_is_served_without_waiting(cache_dir, clock):
+    fetch = FakeFetch(records(("a", 1.0, 51.0, -1.0)))
+    df, version = get_snapshot(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert df['uuid'].tolist() == ["a"]
+
+    clock[0] += 3600
+    assert get_snapshot(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir) == (df, version)
+    assert fetch.calls == [PARAMS]
+    assert data_cache.cache_key(PARAMS) in data_cache._refreshers
+
+
+# The background refresher pulls in new records by itself
+def test_refresher_keeps_the_cache_fresh(cache_dir, monkeypatch):
+    # The thread outlives the test, so it gets a query of its own
+    params = {"q": 'taxon_name:"Martes martes"'}
+    monkeypatch.setattr(data_cache, "REFRESH_POLL_SECONDS", 0.01)
+    fetch = FakeFetch(records(("a", 1.0, 51.0, -1.0)), records(("b", 2.0, 52.0, -2.0)), *[None] * 1000)
+    get_occurrences(params, fetch=fetch, cache_dir=cache_dir)
+
+    start_refresher(params, ttl=0, fetch=fetch, cache_dir=cache_dir)
+    deadline = time.time() + 5
+    while len(data_cache.peek(params, cache_dir)[0]) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert data_cache.peek(params, cache_dir)[0]['uuid'].tolist() == ["a", "b"]
+
+
+def test_snapshot_of_an_unreachable_query_is_empty(cache_dir, clock):
+    fetch = FakeFetch(requests.ConnectionError("API down"), requests.ConnectionError("API down"))
+    assert get_snapshot(PARAMS, fetch=fetch, cache_dir=cache_dir) == (None, None)
+
+
+def test_refresh_status(cache_dir, clock):
+    fetch = FakeFetch(records(("a", 1.0, 51.0, -1.0)), requests.ConnectionError("API down"), None)
+    assert refresh_status(PARAMS) is None
+
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert refresh_status(PARAMS) == {"checked_at": clock[0], "error": None}
+    clock[0] += 61
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert refresh_status(PARAMS) == {"checked_at": clock[0], "error": "API down"}
+    clock[0] += 61
+    get_occurrences(PARAMS, ttl=60, fetch=fetch, cache_dir=cache_dir)
+    assert refresh_status(PARAMS) == {"checked_at": clock[0], "error": None}
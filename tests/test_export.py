@@ -0,0 +1,102 @@
+# Tests for the chunked export filters and file formats, and for hotspot membership
+
+# Import packages
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_occurrences, combine_occurrences
+from export import count_rows, export_bytes, iter_chunks
+from hotspots import find_hotspots, hotspot_mask
+
+
+# Cleaned frame of two species, with some sightings bunched into a few clusters and some without a location
+@pytest.fixture
+def clean():
+    rng = np.random.default_rng(3)
+    frames = []
+    for species in ["Otter", "Badger"]:
+        n = 3_000
+        centre = rng.integers(0, 3, n)
+        lat = np.array([51.5, 52.2, 53.0])[centre] + rng.normal(0, 0.03, n)
+        lon = np.array([-1.2, -0.4, -2.1])[centre] + rng.normal(0, 0.04, n)
+        lat[::40] = np.nan
+        raw = pd.DataFrame({
+            'eventDate': rng.integers(1.2e12, 1.7e12, n).astype('float64'),
+            'decimalLatitude': lat,
+            'decimalLongitude': lon,
+        })
+        frames.append(clean_occurrences(raw, species))
+    return combine_occurrences(frames)
+
+
+def concat(chunks):
+    chunks = list(chunks)
+    return pd.concat(chunks) if chunks else None
+
+
+def test_chunked_filters_match_a_plain_mask(clean):
+    start, end = pd.Timestamp("2012-06-01"), pd.Timestamp("2018-01-01")
+    bbox = (-1.3, 51.4, -0.3, 52.3)
+    # The hotspot around the cluster at 51.5, -1.2, inside the area
+    hotspots = find_hotspots(clean['lat'], clean['lon'], top_n=3)
+    hotspot = hotspots[hotspots['lat'] < 51.8]['cells'].iloc[0]
+
+    lat, lon = clean['lat'], clean['lon']
+    in_dates = (clean['date'] >= start) & (clean['date'] < end)
+    in_bbox = (lat >= bbox[1]) & (lat <= bbox[3]) & (lon >= bbox[0]) & (lon <= bbox[2])
+    in_hotspot = hotspot_mask(lat, lon, hotspot)
+
+    for filters, mask in [
+        ({"start": start, "end": end}, in_dates),
+        ({"bbox": bbox}, in_bbox),
+        ({"hotspot": hotspot}, in_hotspot),
+        ({"start": start, "end": end, "bbox": bbox, "hotspot": hotspot}, in_dates & in_bbox & in_hotspot),
+    ]:
+        expected = clean[mask]
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(concat(iter_chunks(clean, chunk_rows=700, **filters)), expected)
+        assert count_rows(clean, **filters) == len(expected)
+
+
+def test_csv_round_trip(clean):
+    bbox = (-1.3, 51.4, -0.3, 52.3)
+    expected = concat(iter_chunks(clean, bbox=bbox)).reset_index(drop=True)
+    data = pd.read_csv(io.BytesIO(export_bytes(clean, "csv", bbox=bbox)), parse_dates=['date'])
+    assert data.columns.tolist() == clean.columns.tolist()
+    assert data['date'].tolist() == expected['date'].dt.normalize().tolist()
+    assert data['species'].tolist() == expected['species'].tolist()
+    assert data['year'].tolist() == expected['year'].tolist()
+    np.testing.assert_allclose(data['lat'], expected['lat'], rtol=1e-6)
+
+
+def test_parquet_round_trip(clean):
+    start = pd.Timestamp("2015-01-01")
+    expected = concat(iter_chunks(clean, start=start)).reset_index(drop=True)
+    data = pd.read_parquet(io.BytesIO(export_bytes(clean, "parquet", start=start)))
+    pd.testing.assert_frame_equal(data, expected)
+
+
+# An export with no matching rows still has the columns
+def test_empty_export(clean):
+    filters = {"start": pd.Timestamp("1900-01-01"), "end": pd.Timestamp("1901-01-01")}
+    assert list(iter_chunks(clean, **filters)) == []
+    assert count_rows(clean, **filters) == 0
+
+    csv = pd.read_csv(io.BytesIO(export_bytes(clean, "csv", **filters)))
+    assert csv.empty and csv.columns.tolist() == clean.columns.tolist()
+
+    parquet = pd.read_parquet(io.BytesIO(export_bytes(clean, "parquet", **filters)))
+    assert parquet.empty and parquet.columns.tolist() == clean.columns.tolist()
+
+
+# Exporting a hotspot gives exactly the sightings counted for it
+def test_hotspot_mask_matches_sightings(clean):
+    located = clean[clean['lat'].notna()]
+    hotspots = find_hotspots(located['lat'], located['lon'], top_n=5)
+    assert len(hotspots) > 1
+    for _, hotspot in hotspots.iterrows():
+        assert hotspot_mask(clean['lat'], clean['lon'], hotspot['cells']).sum() == hotspot['Sightings']
+        assert count_rows(clean, hotspot=hotspot['cells']) == hotspot['Sightings']
@@ -0,0 +1,97 @@
+# Tests for the persistent locality cache, with a stub in place of the Nominatim geocoder
+
+# Import packages
+import threading
+import time
+
+import pytest
+
+import geocode_cache
+from geocode_cache import ERROR_TTL_SECONDS, UNKNOWN, UNKNOWN_TTL_SECONDS, LocalityCache
+
+
+# Called like geopy's reverse, answers from a dict of {(lat, lon): address} and counts its calls
+class StubReverse:
+    def __init__(self, addresses=None, fail=False, release=None):
+        self.addresses = addresses or {}
+        self.fail = fail
+        self.release = release
+        self.calls = []
+
+    def __call__(self, point, exactly_one=True, language='en'):
+        self.calls.append(point)
+        if self.release is not None:
+            self.release.wait(5)
+        if self.fail:
+            raise OSError("geocoder unavailable")
+
+        class Location:
+            raw = {"address": self.addresses.get(point, {})}
+        return Location()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "localities.sqlite")
+
+
+def test_resolve_caches_the_locality(db_path):
+    reverse = StubReverse({(51.5, -1.25): {"town": "Didcot"}})
+    cache = LocalityCache(reverse=reverse, db_path=db_path)
+    assert cache.get(51.5, -1.25) is None
+    assert cache.resolve(51.5, -1.25) == "Didcot"
+    # Nearby points round to the same key and are answered from the cache
+    assert cache.get(51.50004, -1.24996) == "Didcot"
+    assert len(reverse.calls) == 1
+
+
+def test_cache_persists_across_instances(db_path):
+    LocalityCache(reverse=StubReverse({(51.5, -1.25): {"city": "Oxford"}}), db_path=db_path).resolve(51.5, -1.25)
+    assert LocalityCache(reverse=StubReverse(), db_path=db_path).get(51.5, -1.25) == "Oxford"
+
+
+def test_unknown_answers_expire(db_path, monkeypatch):
+    cache = LocalityCache(reverse=StubReverse(), db_path=db_path)
+    assert cache.resolve(51.5, -1.25) == UNKNOWN
+    assert cache.get(51.5, -1.25) == UNKNOWN
+
+    now = time.time()
+    monkeypatch.setattr(geocode_cache.time, "time", lambda: now + UNKNOWN_TTL_SECONDS + 1)
+    assert cache.get(51.5, -1.25) is None
+
+
+def test_failed_lookups_are_retried_sooner(db_path, monkeypatch):
+    cache = LocalityCache(reverse=StubReverse(fail=True), db_path=db_path)
+    assert cache.resolve(51.5, -1.25) == UNKNOWN
+    assert cache.get(51.5, -1.25) == UNKNOWN
+
+    now = time.time()
+    monkeypatch.setattr(geocode_cache.time, "time", lambda: now + ERROR_TTL_SECONDS + 1)
+    assert cache.get(51.5, -1.25) is None
+
+
+def test_known_localities_never_expire(db_path, monkeypatch):
+    cache = LocalityCache(reverse=StubReverse({(51.5, -1.25): {"village": "Sutton Courtenay"}}), db_path=db_path)
+    cache.resolve(51.5, -1.25)
+
+    now = time.time()
+    monkeypatch.setattr(geocode_cache.time, "time", lambda: now + 10 * UNKNOWN_TTL_SECONDS)
+    assert cache.get(51.5, -1.25) == "Sutton Courtenay"
+
+
+# Misses come back as None straight away and are looked up once in the background
+def test_lookup_resolves_misses_in_the_background(db_path):
+    release = threading.Event()
+    reverse = StubReverse({(51.5, -1.25): {"town": "Didcot"}, (52.0, 0.5): {"town": "Sudbury"}}, release=release)
+    cache = LocalityCache(reverse=reverse, db_path=db_path)
+
+    assert cache.lookup([(51.5, -1.25), (52.0, 0.5)]) == [None, None]
+    assert cache.busy()
+    # Points already queued aren't queued again
+    assert cache.lookup([(51.5, -1.25)]) == [None]
+
+    release.set()
+    cache.wait()
+    assert not cache.busy()
+    assert cache.lookup([(51.5, -1.25), (52.0, 0.5)]) == ["Didcot", "Sudbury"]
+    assert sorted(reverse.calls) == [(51.5, -1.25), (52.0, 0.5)]
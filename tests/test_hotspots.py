@@ -0,0 +1,63 @@
+# Tests for hotspot clustering on hand-built layouts of grid cells
+
+# Import packages
+import numpy as np
+
+from aggregates import UK_LAT
+from hotspots import HOTSPOT_CELL_KM, KM_PER_DEGREE, find_hotspots, hotspot_mask
+
+
+# `count` sightings at the centre of grid cell (x, y), the inverse of hotspots._grid_cells
+def cell_points(x, y, count):
+    lon = (x + 0.5) * HOTSPOT_CELL_KM / (np.cos(np.radians(UK_LAT)) * KM_PER_DEGREE)
+    lat = (y + 0.5) * HOTSPOT_CELL_KM / KM_PER_DEGREE
+    return np.full(count, lat), np.full(count, lon)
+
+
+def layout(cells):
+    points = [cell_points(x, y, count) for (x, y), count in cells.items()]
+    return np.concatenate([lat for lat, _ in points]), np.concatenate([lon for _, lon in points])
+
+
+def test_busiest_neighbourhood_seeds_a_block():
+    # A busy cell with two neighbours, and a lone busier cell far away
+    lat, lon = layout({(-40, 3000): 10, (-39, 3000): 4, (-40, 3001): 3, (0, 3100): 12})
+    hotspots = find_hotspots(lat, lon, top_n=2)
+    assert hotspots['Sightings'].tolist() == [17, 12]
+    assert hotspots['cells'][0] == ((-40, 3000), (-40, 3001), (-39, 3000))
+    assert hotspots['cells'][1] == ((0, 3100),)
+    # The centroid is the mean of the members
+    assert np.isclose(hotspots['lat'][0], lat[:17].mean()) and np.isclose(hotspots['lon'][0], lon[:17].mean())
+
+
+# Cells with an empty cell between them aren't neighbours, so they stay separate hotspots
+def test_cells_a_gap_apart_are_separate():
+    lat, lon = layout({(0, 3000): 20, (2, 3000): 15, (2, 3002): 9, (20, 3000): 5})
+    hotspots = find_hotspots(lat, lon, top_n=5)
+    assert hotspots['Sightings'].tolist() == [20, 15, 9, 5]
+    assert [len(cells) for cells in hotspots['cells']] == [1, 1, 1, 1]
+
+
+# Blocks with cells next to each other are one hotspot, however the grid splits them
+def test_touching_blocks_are_merged():
+    # A line of busy cells longer than a block, and a separate smaller cluster
+    line = {(x, 3000): 10 for x in range(7)}
+    lat, lon = layout({**line, (30, 3000): 25})
+    hotspots = find_hotspots(lat, lon, top_n=2)
+    assert hotspots['Sightings'].tolist() == [70, 25]
+    assert hotspots['cells'][0] == tuple(sorted(line))
+
+
+def test_hotspot_mask_selects_the_claimed_cells():
+    lat, lon = layout({(0, 3000): 8, (1, 3001): 6, (3, 3000): 4, (9, 3000): 5})
+    lat = np.append(lat, np.nan)
+    lon = np.append(lon, np.nan)
+    for _, hotspot in find_hotspots(lat[:-1], lon[:-1], top_n=3).iterrows():
+        mask = hotspot_mask(lat, lon, hotspot['cells'])
+        assert mask.sum() == hotspot['Sightings']
+        assert not mask[-1]
+
+
+def test_no_sightings():
+    hotspots = find_hotspots([], [])
+    assert hotspots.empty and hotspots.columns.tolist() == ['lat', 'lon', 'Sightings', 'cells']
@@ -0,0 +1,103 @@
+# Tests for the paginated NBN fetcher, run against the local stub API in benchmarks/stub_nbn.py
+
+# Import packages
+import json
+
+import numpy as np
+import pytest
+import requests
+
+from benchmarks.stub_nbn import start_stub_api
+from nbn_api import DASHBOARD_FL, fetch_occurrences, parse_projected
+
+
+@pytest.fixture
+def stub_api():
+    servers = []
+
+    def start(total, fail_every=None):
+        server, url = start_stub_api(total, seed=1, fail_every=fail_every)
+        servers.append(server)
+        return server, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def uuids(count):
+    return [f"00000000-0000-4000-8000-{index:012d}" for index in range(count)]
+
+
+# Pages come back from the pool in any order, but are stitched together in index order
+def test_pages_are_stitched_in_order(stub_api):
+    server, url = stub_api(2_345)
+    df = fetch_occurrences({"q": "Lutra lutra"}, url=url, page_size=200, max_workers=4, backoff=0)
+    assert df['uuid'].tolist() == uuids(2_345)
+    assert server.request_count == 12
+
+
+def test_projected_pages_are_stitched_in_order(stub_api):
+    _, url = stub_api(1_050)
+    df = fetch_occurrences({"q": "Lutra lutra", "fl": DASHBOARD_FL}, url=url, page_size=100, backoff=0)
+    assert list(df.columns) == ['uuid', 'eventDate', 'decimalLatitude', 'decimalLongitude']
+    assert df['uuid'].tolist() == uuids(1_050)
+
+
+def test_max_records_caps_the_pages_fetched(stub_api):
+    server, url = stub_api(5_000)
+    df = fetch_occurrences({"q": "Lutra lutra"}, url=url, page_size=300, max_records=1_000, backoff=0)
+    assert df['uuid'].tolist() == uuids(1_000)
+    assert server.request_count == 4
+
+
+# Every third request gets a 503, each one is retried and nothing is lost
+def test_retries_on_503(stub_api):
+    server, url = stub_api(1_000, fail_every=3)
+    df = fetch_occurrences({"q": "Lutra lutra"}, url=url, page_size=100, max_workers=2, backoff=0)
+    assert df['uuid'].tolist() == uuids(1_000)
+    assert server.request_count > 10
+
+
+def test_gives_up_after_the_retries(stub_api):
+    _, url = stub_api(1_000, fail_every=1)
+    with pytest.raises(requests.HTTPError):
+        fetch_occurrences({"q": "Lutra lutra"}, url=url, page_size=100, retries=2, backoff=0)
+
+
+def test_no_records(stub_api):
+    _, url = stub_api(0)
+    assert fetch_occurrences({"q": "Lutra lutra"}, url=url, backoff=0) is None
+
+
+def test_parse_projected_keeps_requested_fields():
+    content = json.dumps({
+        "totalRecords": 3,
+        "occurrences": [
+            {"uuid": "a", "eventDate": 1000, "decimalLatitude": 51.5, "decimalLongitude": -1.25, "species": "x"},
+            {"uuid": "b", "decimalLatitude": "not a number"},
+            {"uuid": "c", "eventDate": 2000, "decimalLatitude": 52.0, "decimalLongitude": 0.5},
+        ],
+        "facetResults": [{"fieldName": "year", "fieldResult": []}],
+    })
+    page = parse_projected(content, DASHBOARD_FL)
+
+    df = page["occurrences"]
+    assert list(df.columns) == ['uuid', 'eventDate', 'decimalLatitude', 'decimalLongitude']
+    assert df['uuid'].tolist() == ["a", "b", "c"]
+    assert df['eventDate'].dtype == np.float64
+    np.testing.assert_array_equal(df['eventDate'], [1000, np.nan, 2000])
+    np.testing.assert_array_equal(df['decimalLatitude'], [51.5, np.nan, 52.0])
+    # Everything that isn't an occurrence is left alone
+    assert page["totalRecords"] == 3
+    assert page["facetResults"] == [{"fieldName": "year", "fieldResult": []}]
+
+
+# The response may use either the index name or the occurrence name for a field
+def test_parse_projected_accepts_index_names():
+    content = json.dumps({"occurrences": [{"id": "a", "occurrence_date": 5, "latitude": 51.0}]})
+    df = parse_projected(content, DASHBOARD_FL)["occurrences"]
+    assert df['uuid'].tolist() == ["a"]
+    assert df['eventDate'].tolist() == [5.0]
+    assert df['decimalLatitude'].tolist() == [51.0]
+    assert np.isnan(df['decimalLongitude'][0])
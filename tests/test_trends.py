@@ -0,0 +1,78 @@
+# Tests for the per-area trend fit, on synthetic cubes with known trends
+
+# Import packages
+import numpy as np
+import pandas as pd
+
+from queries import SPECIES
+from trends import AREA_CELLS, area_trends
+
+YEARS = np.arange(2010, 2025)
+
+
+# Cube rows for one area, with yearly sightings drawn around `expected` (one value per year)
+def area_rows(lat_cell, lon_cell, expected, species="Otter", seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'year': YEARS.astype('int16'),
+        'month': np.full(len(YEARS), 6, dtype='int16'),
+        'lat_cell': np.full(len(YEARS), lat_cell, dtype='int16'),
+        'lon_cell': np.full(len(YEARS), lon_cell, dtype='int16'),
+        'species': pd.Categorical([species] * len(YEARS), categories=list(SPECIES)),
+        'count': rng.poisson(expected).astype('int32'),
+    })
+
+
+# Recording effort doubles over the period, lifting every area
+EFFORT = 2 ** ((YEARS - YEARS[0]) / (len(YEARS) - 1))
+
+RISING = (510, -10)
+DECLINING = (540, -20)
+STEADY = [(520, 0), (530, 5), (560, -30)]
+
+
+def otter_cube():
+    rows = [
+        area_rows(*RISING, 60 * EFFORT * 1.12 ** (YEARS - YEARS[0]), seed=1),
+        area_rows(*DECLINING, 300 * EFFORT * 0.9 ** (YEARS - YEARS[0]), seed=2),
+    ]
+    rows += [area_rows(*cell, 200 * EFFORT, seed=3 + i) for i, cell in enumerate(STEADY)]
+    return pd.concat(rows, ignore_index=True)
+
+
+def trend_at(trends, cell):
+    lat = (cell[0] // AREA_CELLS + 0.5) * AREA_CELLS * 0.1
+    lon = (cell[1] // AREA_CELLS + 0.5) * AREA_CELLS * 0.1
+    row = trends[np.isclose(trends['lat'], lat) & np.isclose(trends['lon'], lon)]
+    return row['Trend'].item()
+
+
+def test_rising_and_declining_areas_are_found():
+    trends = area_trends(otter_cube(), "Otter")
+    assert len(trends) == 5
+    assert trend_at(trends, RISING) == 'Rising'
+    assert trend_at(trends, DECLINING) == 'Declining'
+    # A general rise in recording isn't a rise everywhere
+    for cell in STEADY:
+        assert trend_at(trends, cell) != 'Rising'
+    # Steepest decline first
+    assert trends['t'].is_monotonic_increasing
+
+
+# Another species rising in an area doesn't change the trend fitted for this one
+def test_trends_are_fitted_per_species():
+    badgers = area_rows(*STEADY[0], 20 * 1.4 ** (YEARS - YEARS[0]), species="Badger", seed=9)
+    cube = pd.concat([otter_cube(), badgers], ignore_index=True)
+    pd.testing.assert_frame_equal(area_trends(cube, "Otter"), area_trends(otter_cube(), "Otter"))
+
+    badger_trends = area_trends(cube, "Badger")
+    assert len(badger_trends) == 1
+
+
+def test_quiet_areas_are_left_out():
+    cube = pd.concat([otter_cube(), area_rows(600, 40, np.full(len(YEARS), 1.0), seed=10)], ignore_index=True)
+    assert len(area_trends(cube, "Otter", min_sightings=100)) == 5
+
+
+def test_no_sightings():
+    assert area_trends(otter_cube(), "Stoat").empty
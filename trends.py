@@ -0,0 +1,93 @@
+# This file fits a sightings trend for every area of the country at once, to spot where records are rising or falling
+
+# Import packages
+import numpy as np
+import pandas as pd
+
+from aggregates import GRID_RES, NO_CELL
+
+# Areas are blocks of 5x5 cube cells, i.e. 0.5 degrees (about 55km north-south)
+AREA_CELLS = 5
+
+# Trends are fitted over the last 15 years
+TREND_YEARS = 15
+
+# Areas with fewer sightings than this over the period are left out, their trends are mostly noise
+MIN_AREA_SIGHTINGS = 30
+
+# How many standard errors from zero a trend has to be to count as rising or declining
+TREND_T_THRESHOLD = 2.0
+
+TREND_COLUMNS = ['lat', 'lon', 'Sightings', 'Change per year', 't', 'Trend']
+
+
+# Fit a trend to every area's yearly sightings in one least squares solve.
+# Sightings are binned by area and year from the cube, then each area's count is divided by that
+# year's national total, which corrects for recording effort (more people recording in recent years
+# lifts every area). The fit is a straight line through the log of that share, so the slope is the
+# proportional change per year relative to the rest of the country. All areas share the same years,
+# so they're the columns of a single right-hand side for np.linalg.lstsq.
+# With `species`, only that species' sightings are used for both the areas and the national totals, so
+# one species rising doesn't lift the trend of another. Otherwise the cube is taken as a single species.
+# Returns one row per area with its centre, total sightings, % change per year, t statistic and trend.
+def area_trends(cube, species=None, last_year=None, years=TREND_YEARS, area_cells=AREA_CELLS,
+                min_sightings=MIN_AREA_SIGHTINGS, t_threshold=TREND_T_THRESHOLD):
+    if species is not None:
+        cube = cube[cube['species'] == species]
+    if cube.empty:
+        return pd.DataFrame(columns=TREND_COLUMNS)
+    last_year = int(cube['year'].max()) if last_year is None else int(last_year)
+    first_year = last_year - years + 1
+
+    in_period = (cube['year'] >= first_year) & (cube['year'] <= last_year)
+    year_index = cube['year'].to_numpy()[in_period] - first_year
+    counts = cube['count'].to_numpy()[in_period].astype('float64')
+    lat_cell = cube['lat_cell'].to_numpy()[in_period]
+    lon_cell = cube['lon_cell'].to_numpy()[in_period]
+
+    # National total per year, including sightings without a location, as the measure of effort
+    totals = np.bincount(year_index, weights=counts, minlength=years)
+
+    # Area for every located cube row, numbered 0..n_areas-1.
+    # Each (lat, lon) area is packed into one integer so factorize can hash it quickly.
+    located = lat_cell != NO_CELL
+    area_lat = lat_cell[located].astype('int32') // area_cells
+    area_lon = lon_cell[located].astype('int32') // area_cells
+    codes, areas = pd.factorize((area_lat.astype('int64') + 2 ** 15) * 2 ** 16 + (area_lon + 2 ** 15))
+    if len(areas) == 0:
+        return pd.DataFrame(columns=TREND_COLUMNS)
+
+    # Areas x years matrix of sightings
+    by_area = np.bincount(codes * years + year_index[located], weights=counts[located],
+                          minlength=len(areas) * years).reshape(len(areas), years)
+    keep = by_area.sum(axis=1) >= min_sightings
+
+    # Years with no records anywhere say nothing about any area
+    recorded = totals > 0
+    if keep.sum() == 0 or recorded.sum() < 3:
+        return pd.DataFrame(columns=TREND_COLUMNS)
+    share = np.log((by_area[keep][:, recorded] + 0.5) / totals[recorded])
+
+    # Straight line through every area's log share at once
+    t = np.arange(years, dtype='float64')[recorded]
+    t = t - t.mean()
+    design = np.column_stack([np.ones_like(t), t])
+    coef, residuals, _, _ = np.linalg.lstsq(design, share.T, rcond=None)
+    slope = coef[1]
+    if residuals.size == 0:
+        residuals = ((share.T - design @ coef) ** 2).sum(axis=0)
+    standard_error = np.sqrt(residuals / (len(t) - 2) / (t ** 2).sum())
+    t_stat = np.divide(slope, standard_error, out=np.zeros_like(slope), where=standard_error > 0)
+
+    trend = np.where(t_stat >= t_threshold, 'Rising', np.where(t_stat <= -t_threshold, 'Declining', 'No clear trend'))
+    area_lat = areas[keep] // 2 ** 16 - 2 ** 15
+    area_lon = areas[keep] % 2 ** 16 - 2 ** 15
+    result = pd.DataFrame({
+        'lat': (area_lat + 0.5) * area_cells * GRID_RES,
+        'lon': (area_lon + 0.5) * area_cells * GRID_RES,
+        'Sightings': by_area[keep].sum(axis=1).astype('int64'),
+        'Change per year': (np.exp(slope) - 1) * 100,
+        't': t_stat,
+        'Trend': trend,
+    })
+    return result.sort_values('t', kind='stable').reset_index(drop=True)